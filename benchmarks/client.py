@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Measures the per-request overhead of base.init(), i.e. a pooled client vs. a new MongoClient (plus list_collection_names()) per call.
+#
+# Usage: python benchmarks/client.py --calls 1000 [--server localhost]
+#
+# This needs a running (local) mongod. Every call is followed by one small query, like a request would do.
+
+import argparse
+
+from time import perf_counter
+
+from pymongo import MongoClient
+
+from universs.base import init
+
+def legacy(server):
+    ''' The former base.init(): a new client and a round trip for the list of collections. '''
+
+    db = MongoClient(server, tz_aware = True).universs
+    db.list_collection_names()
+    return db
+
+def measure(f, server, calls, close = False):
+    ''' Returns the mean latency of f(server) plus one query in milliseconds. '''
+
+    start = perf_counter()
+    for _ in range(calls):
+        db = f(server)
+        db.feeds.find_one()
+        if close:
+            # Otherwise every call leaves a connection pool (and its monitor threads) behind
+            db.client.close()
+    return (perf_counter() - start) / calls * 1000
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the database connection setup per request.')
+    parser.add_argument('--server', default = 'localhost')
+    parser.add_argument('--calls', type = int, default = 1000)
+    args = parser.parse_args()
+
+    print('%-8s %14s' % ('Client', 'Latency [ms]'))
+    for name, f, close in (('new', legacy, True), ('pooled', init, False)):
+        print('%-8s %14.2f' % (name, measure(f, args.server, args.calls, close)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Measures how the CPU-bound ingest stages scale with the number of processes (see CPU_WORKERS).
+#
+# Usage: python benchmarks/cpu.py --feeds 200 --size 20000 --workers 1 2 4 8
+#
+# Stage "parse" is rss._process() (feed parsing, see universs/parser.py), stage "prepare" is tasks.prepare_all()
+# (HTML cleaning and minification). No database is required.
+
+import argparse
+import os
+import sys
+import pytz
+
+from time import perf_counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from farm import generate
+from universs.rss import _process
+from universs.tasks import prepare_all
+from universs.pool import run
+
+def process_all(contents):
+    ''' Parses and post-processes a chunk of feed documents. '''
+    return [article for content in contents for article in _process(content, '')]
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the CPU-bound ingest stages.')
+    parser.add_argument('--feeds', type = int, default = 200)
+    parser.add_argument('--entries', type = int, default = 20, help = 'Number of entries per feed')
+    parser.add_argument('--size', type = int, default = 20000, help = 'Mean size of an article body in bytes')
+    parser.add_argument('--workers', type = int, nargs = '+', default = sorted(set([1, 2, 4, os.cpu_count() or 1])))
+    parser.add_argument('--chunk', type = int, default = 100, help = 'Articles per work unit')
+    args = parser.parse_args()
+
+    now = pytz.utc.localize(datetime.utcnow())
+    contents = [generate(n, args.entries, args.size) for n in range(args.feeds)]
+    articles = process_all(contents)
+    for article in articles:
+        article['feed-id'] = 'feed'
+    print('Corpus: %d articles, %.1f MB of HTML' % (len(articles), sum(len(article['content']) for article in articles) / 1024.0**2))
+
+    print('%-8s %8s %16s %16s' % ('Workers', 'Chunk', 'parse [art./s]', 'prepare [art./s]'))
+    for workers in args.workers:
+        # Feeds are the natural work unit for parsing, one chunk holds several feeds
+        start = perf_counter()
+        run(process_all, contents, chunk = max(1, args.chunk // args.entries), workers = workers)
+        parsing = len(articles) / (perf_counter() - start)
+
+        start = perf_counter()
+        run(prepare_all, [dict(article) for article in articles], {'feed' : []}, now, chunk = args.chunk, workers = workers)
+        preparing = len(articles) / (perf_counter() - start)
+
+        print('%-8d %8d %16.1f %16.1f' % (workers, args.chunk, parsing, preparing))
+
+if __name__ == '__main__':
+    main()
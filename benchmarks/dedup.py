@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Compares the per-article deduplication queries in tasks.download() with the batched $in lookup.
+#
+# Usage: python benchmarks/dedup.py --entries 100000 [--server localhost]
+#
+# This needs a running (local) mongod, all data is written to (and dropped from) the "universs_benchmark" database.
+
+import argparse
+
+from time import perf_counter
+from hashlib import md5
+
+from pymongo import MongoClient
+
+from universs.tasks import deduplicate
+
+def entries(n, feeds = 1000):
+    ''' Returns n fetched (i.e. not yet processed) synthetic articles. '''
+    return [{'feed-id' : 'feed-%d' % (i % feeds), 'title' : 'Article %d' % i} for i in range(n)]
+
+def legacy(db, articles):
+    ''' The former deduplication in tasks.download(), i.e. two queries per article. '''
+
+    queue = []
+    for article in articles:
+        uid = md5(('%s - %s' % (article['feed-id'], article['title'])).encode('utf-8')).hexdigest()
+        if db.articles.count_documents({'_id' : uid}, limit = 1):
+            continue
+        else:
+            article['_id'] = uid
+            if not db.downloads.count_documents({'_id' : uid}, limit = 1):
+                queue.append(article)
+    return queue
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the deduplication of downloaded articles.')
+    parser.add_argument('--server', default = 'localhost')
+    parser.add_argument('--entries', type = int, default = 100000)
+    parser.add_argument('--known', type = float, default = 0.9, help = 'Fraction of entries that are already in the database')
+    args = parser.parse_args()
+
+    db = MongoClient(args.server, tz_aware = True).universs_benchmark
+    db.articles.drop()
+    db.downloads.drop()
+
+    # Typically, most entries of a feed have been seen before
+    articles = entries(args.entries)
+    k = int(args.known * len(articles))
+    seen = [dict(article) for article in articles[:k]]
+    deduplicate(db, seen)
+    db.articles.insert_many(seen[:k // 2])
+    db.downloads.insert_many(seen[k // 2:])
+
+    print('%-10s %10s %10s %12s' % ('Method', 'Entries', 'New', 'Time [s]'))
+    for name, f in (('legacy', legacy), ('batched', lambda db, articles: deduplicate(db, articles)[0])):
+        start = perf_counter()
+        queue = f(db, [dict(article) for article in articles])
+        print('%-10s %10d %10d %12.2f' % (name, len(articles), len(queue), perf_counter() - start))
+
+    db.client.drop_database(db.name)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Checks the query plans of all article list queries (base.build_query/base.get), their counts and the queries of the
+# metadata tasks and the scheduler against the indexes declared in universs.indexes. Every plan that scans the whole
+# collection (COLLSCAN) or sorts in memory (SORT) is reported and the script exits with a non-zero status.
+#
+# Usage: python benchmarks/explain.py --articles 20000 [--server localhost]
+#
+# This needs a running (local) mongod. All data is written to a separate "universs_explain" database,
+# which is dropped at the end of the run unless --keep is given.
+
+import argparse
+import sys
+
+from datetime import datetime
+
+import pytz
+
+from flask import request
+from pymongo import MongoClient
+
+from universs import app
+from universs.base import find, latest, build_query, encode_cursor, _match
+from universs.indexes import reconcile, violations
+from universs.scheduler import due
+from universs.tasks import aggregation
+
+from query import seed
+
+# Query strings of the article lists, see base.build_query()
+VIEWS = [
+    '', 'unread', 'read', 'all', 'marked', 'unmarked', 'starred', 'all&starred', 'unread&unstarred', 'reversed', 'page=5', 'limit=10',
+    'after=%(after)s', 'before=%(before)s', 'reversed&after=%(after)s', 'unread&after=%(after)s', 'count&after=%(after)s',
+]
+
+# Scopes of the article lists: all feeds, one feed and one tag
+SCOPES = [{}, {'feed-id' : 'feed-1'}, {'tags' : 'tag-1'}]
+
+def shapes(db, now):
+    ''' Yields a name and the output of explain() for every query shape. '''
+
+    article = db.articles.find_one(sort = [('date', -1)], skip = 1000)
+    tokens = {'after' : encode_cursor(article), 'before' : encode_cursor(article)}
+
+    for scope in SCOPES:
+        for view in VIEWS:
+            with app.test_request_context('/?' + view % tokens):
+                query = build_query(request, scope)
+            name = '%s ?%s' % (', '.join('%s=%s' % item for item in scope.items()) or 'all feeds', view % {'after' : '…', 'before' : '…'})
+            yield 'get() ' + name, find(db, query).explain()
+            if query.get('count', True):
+                yield 'count() ' + name, db.command('explain', {'count' : 'articles', 'query' : _match(query)})
+
+    # RSS outputs of a feed, a tag and the starred articles
+    for scope in SCOPES[1:] + [{'starred' : True}]:
+        yield 'latest() %s' % ', '.join('%s=%s' % item for item in scope.items()), latest(db, scope).explain()
+
+    # Metadata tasks, incremental and full (see tasks.changed and tasks.update_feed_metadata/update_tag_metadata)
+    feedids = ['feed-%d' % i for i in range(10)]
+    yield 'changed()', db.command('explain', {'distinct' : 'articles', 'key' : 'feed-id', 'query' : {'$or' : [{'downloaded' : {'$gte' : now}}, {'modified' : {'$gte' : now}}]}})
+    yield 'counters() feed-id', db.command('aggregate', 'articles', pipeline = aggregation('feed-id', {'feed-id' : {'$in' : feedids}}), explain = True)
+    yield 'counters() tags', db.command('aggregate', 'articles', pipeline = aggregation('tags', {'tags' : {'$in' : ['tag-1', 'tag-2']}}), explain = True)
+    yield 'feeds by tag', db.feeds.find({'tags' : {'$in' : ['tag-1']}}, projection = ('tags',)).explain()
+    yield 'feed by title', db.feeds.find({'title' : 'feed-1'}).explain()
+    yield 'tag by title', db.tags.find({'title' : 'tag-1'}).explain()
+
+    # Scheduler
+    yield 'due()', due(db, now).explain()
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Check the query plans against the declared indexes.')
+    parser.add_argument('--server', default = 'localhost')
+    parser.add_argument('--articles', type = int, default = 20000)
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the database')
+    args = parser.parse_args()
+
+    db = MongoClient(args.server, tz_aware = True).universs_explain
+    now = pytz.utc.localize(datetime.utcnow())
+    if db.articles.estimated_document_count() != args.articles:
+        print('Seeding %d articles...' % args.articles)
+        seed(db, args.articles)
+    db.feeds.drop()
+    db.feeds.insert_many([{'_id' : 'feed-%d' % i, 'title' : 'feed-%d' % i, 'tags' : ['tag-%d' % (i % 20)], 'active' : True, 'next-due' : now} for i in range(500)])
+    db.tags.drop()
+    db.tags.insert_many([{'_id' : 'tag-%d' % i, 'title' : 'tag-%d' % i} for i in range(20)])
+    reconcile(db)
+
+    failures = 0
+    for name, plan in shapes(db, now):
+        stages = violations(plan)
+        failures += bool(stages)
+        print('%-6s %-60s %s' % ('FAIL' if stages else 'ok', name, ', '.join(stages)))
+
+    if not args.keep:
+        db.client.drop_database(db.name)
+
+    print('%d query shapes with a collection scan or an in-memory sort.' % failures)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# A local HTTP server that serves thousands of synthetic RSS/Atom feeds, so the feed fetcher can be measured offline.
+#
+# Usage: python benchmarks/farm.py --feeds 3000 --port 8900 --latency 0.05 [--hosts 8] [--errors 0.02] [--variable]
+#
+# Feed n is served at http://127.0.0.1:<port + n % hosts>/feeds/<n>.xml, every port stands for another host,
+# i.e. the fetcher's per-host connection limit applies per port.
+
+import argparse
+import asyncio
+import gzip
+import math
+import random
+
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+RSS = {
+    'feed' : '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Feed %(n)d</title>'
+             '<link>http://example.com/%(n)d</link><description>Synthetic feed %(n)d</description>%(entries)s</channel></rss>',
+    'entry' : '<item><title>Feed %(n)d, article %(i)d: %(title)s</title><link>http://example.com/%(n)d/%(i)d</link>'
+              '<guid>http://example.com/%(n)d/%(i)d</guid><author>author-%(author)d@example.com</author>'
+              '<pubDate>%(date)s</pubDate><description>%(content)s</description></item>',
+    'format' : '%a, %d %b %Y %H:%M:%S +0000',
+}
+
+ATOM = {
+    'feed' : '<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom"><title>Feed %(n)d</title>'
+             '<link href="http://example.com/%(n)d"/><id>http://example.com/%(n)d</id><updated>%(date)s</updated>%(entries)s</feed>',
+    'entry' : '<entry><title>Feed %(n)d, article %(i)d: %(title)s</title><link href="http://example.com/%(n)d/%(i)d"/>'
+              '<id>http://example.com/%(n)d/%(i)d</id><author><name>author-%(author)d</name></author>'
+              '<updated>%(date)s</updated><content type="html">%(content)s</content></entry>',
+    'format' : '%Y-%m-%dT%H:%M:%SZ',
+}
+
+WORDS = 'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua'.split()
+
+def generate(n, entries = 20, size = 2000, variable = False, atom = 0.0):
+    ''' Returns a synthetic RSS 2.0 or Atom document for feed n (the output is deterministic for every n). '''
+
+    rng = random.Random(n)
+    now = datetime(2020, 1, 1) - timedelta(hours = n)
+
+    if variable:
+        # Real feeds are heavy-tailed: most of them have a few short entries, some have hundreds of long ones
+        entries = min(500, max(1, int(rng.lognormvariate(math.log(entries), 0.8))))
+        length = lambda: int(rng.lognormvariate(math.log(size) - 0.5, 1.0))
+    else:
+        length = lambda: int(rng.expovariate(1 / size))
+    # The format is chosen per feed, about this fraction of the feeds is Atom
+    template = ATOM if rng.random() < atom else RSS
+
+    items = []
+    for i in range(entries):
+        words = ' '.join(rng.choice(WORDS) for _ in range(max(1, length() // 6)))
+        date = now - timedelta(minutes = 37 * i)
+        items.append(template['entry'] % {
+            'n' : n, 'i' : i, 'title' : escape(' '.join(rng.sample(WORDS, 4))), 'author' : rng.randint(1, 5),
+            'date' : date.strftime(template['format']), 'content' : escape('<p>%s</p>' % words)
+        })
+
+    return (template['feed'] % {'n' : n, 'entries' : ''.join(items), 'date' : now.strftime(template['format'])}).encode('utf-8')
+
+def urls(feeds, port = 8900, host = '127.0.0.1', hosts = 1):
+    ''' Returns (title, url, feedid) tuples for all synthetic feeds, as expected by universs.rss.pull(). '''
+    return [('Feed %d' % n, 'http://%s:%d/feeds/%d.xml' % (host, port + n % hosts, n), 'feed-%d' % n) for n in range(feeds)]
+
+def application(feeds = 3000, latency = 0.0, entries = 20, size = 2000, validators = True, jitter = 0.0, errors = 0.0, variable = False, atom = 0.0, seed = 0):
+    ''' Returns the aiohttp application serving the synthetic feeds. '''
+
+    cache, compressed, rng = {}, {}, random.Random(seed)
+
+    async def handle(request):
+        n = int(request.match_info['n'])
+        if n >= feeds:
+            raise web.HTTPNotFound()
+        if n not in cache:
+            cache[n] = generate(n, entries, size, variable, atom)
+        if latency:
+            # Normally distributed around the mean latency, jitter is the relative standard deviation
+            await asyncio.sleep(max(0.0, rng.gauss(latency, latency * jitter)))
+
+        body, headers = cache[n], {'Content-Type' : 'application/rss+xml; charset=utf-8', 'ETag' : '"%d"' % n, 'Last-Modified' : 'Wed, 01 Jan 2020 00:00:00 GMT'}
+        if rng.random() < errors:
+            # Failures seen in the wild: server errors, truncated documents and servers that never answer
+            failure = rng.choice(('error', 'truncated', 'timeout'))
+            if failure == 'error':
+                raise web.HTTPInternalServerError()
+            elif failure == 'truncated':
+                return web.Response(body = body[:len(body) // 2], headers = {'Content-Type' : headers['Content-Type']})
+            await asyncio.sleep(60)
+
+        # The synthetic feeds never change, i.e. conditional requests can always be answered with 304
+        if validators and request.headers.get('If-None-Match') == headers['ETag']:
+            return web.Response(status = 304, headers = headers)
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            # Compressed once like the static files of a real server (or a CDN), the farm shares the CPU with the client
+            if n not in compressed:
+                compressed[n] = gzip.compress(body, 1)
+            body, headers['Content-Encoding'] = compressed[n], 'gzip'
+        return web.Response(body = body, headers = headers)
+
+    app = web.Application()
+    app.router.add_get(r'/feeds/{n:\d+}.xml', handle)
+    return app
+
+def serve(feeds = 3000, port = 8900, host = '127.0.0.1', latency = 0.0, entries = 20, size = 2000, validators = True, hosts = 1, **kwargs):
+    ''' Runs the feed farm on ports port ... port + hosts - 1 (blocking), see application() for the remaining arguments. '''
+
+    async def run():
+        runner = web.AppRunner(application(feeds, latency, entries, size, validators, **kwargs), access_log = None)
+        await runner.setup()
+        for offset in range(hosts):
+            await web.TCPSite(runner, host, port + offset).start()
+        # Serve until the process is terminated
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Serve synthetic RSS/Atom feeds.')
+    parser.add_argument('--feeds', type = int, default = 3000)
+    parser.add_argument('--port', type = int, default = 8900)
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--hosts', type = int, default = 1, help = 'Number of ports (i.e. hosts) the feeds are spread over')
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'Mean artificial latency per response in seconds')
+    parser.add_argument('--jitter', type = float, default = 0.0, help = 'Standard deviation of the latency relative to its mean')
+    parser.add_argument('--errors', type = float, default = 0.0, help = 'Fraction of failed responses (500, truncated or no response)')
+    parser.add_argument('--entries', type = int, default = 20, help = 'Number of entries per feed (median if --variable)')
+    parser.add_argument('--size', type = int, default = 2000, help = 'Mean size of an entry in bytes')
+    parser.add_argument('--variable', action = 'store_true', help = 'Draw entries per feed and entry sizes from heavy-tailed distributions')
+    parser.add_argument('--atom', type = float, default = 0.0, help = 'Fraction of Atom (instead of RSS) feeds')
+    parser.add_argument('--no-validators', action = 'store_true', help = 'Never answer conditional requests with 304')
+    args = parser.parse_args()
+
+    print('Serving %d feeds on http://%s:%d-%d/feeds/<n>.xml' % (args.feeds, args.host, args.port, args.port + args.hosts - 1))
+    serve(args.feeds, args.port, args.host, args.latency, args.entries, args.size, not args.no_validators, args.hosts,
+          jitter = args.jitter, errors = args.errors, variable = args.variable, atom = args.atom)
+
+if __name__ == '__main__':
+    main()
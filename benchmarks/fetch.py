@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Compares the feeds/s of the asyncio fetcher and the joblib thread pool (the default) in universs.rss.pull().
+#
+# Usage: python benchmarks/fetch.py --feeds 3000 --latency 0.05 [--jobs 400]
+#
+# The asyncio fetcher only pulls ahead with many concurrent connections (--jobs), with 120 both backends are on par.
+# The synthetic feeds are served by benchmarks/farm.py in a separate process, no internet connection is required.
+
+import argparse
+import os
+import sys
+
+from time import perf_counter, sleep
+from multiprocessing import Process
+from socket import create_connection
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from farm import serve, urls
+from universs.rss import pull
+
+def wait(port, host = '127.0.0.1', timeout = 10):
+    ''' Blocks until the feed farm accepts connections. '''
+
+    start = perf_counter()
+    while perf_counter() - start < timeout:
+        try:
+            create_connection((host, port)).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise RuntimeError('Feed farm did not start')
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the feed fetcher.')
+    parser.add_argument('--feeds', type = int, default = 3000)
+    parser.add_argument('--port', type = int, default = 8900)
+    parser.add_argument('--latency', type = float, default = 0.05, help = 'Artificial latency per response in seconds')
+    parser.add_argument('--jobs', type = int, default = 120, help = 'Threads for joblib, connections for asyncio')
+    args = parser.parse_args()
+
+    server = Process(target = serve, kwargs = {'feeds' : args.feeds, 'port' : args.port, 'latency' : args.latency}, daemon = True)
+    server.start()
+    try:
+        wait(args.port)
+        feeds = urls(args.feeds, args.port)
+        # Warm up the server's cache, so both runs are served the same way
+        pull(feeds, args.jobs, backend = 'asyncio', per_host = args.jobs)
+
+        print('%-10s %8s %10s %10s' % ('Backend', 'Feeds', 'Articles', 'Feeds/s'))
+        for backend in ('threading', 'asyncio'):
+            # All synthetic feeds live on the same host, so don't limit the connections per host here
+            kwargs = {'per_host' : args.jobs} if backend == 'asyncio' else {}
+            start = perf_counter()
+            articles = pull(feeds, args.jobs, timeout = 10, verbose = 0, backend = backend, **kwargs)
+            elapsed = perf_counter() - start
+            print('%-10s %8d %10d %10.1f' % (backend, len(feeds), len(articles), len(feeds) / elapsed))
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    main()
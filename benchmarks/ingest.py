@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Measures the update pipeline end to end against the synthetic feed farm (benchmarks/farm.py) and a local mongod:
+# rss.pull() (fetch and parse only), tasks.download() (fetch, parse, deduplicate, queue) and tasks.process() (clean and push).
+#
+# Usage: python benchmarks/ingest.py --feeds 1000 --rounds 5 --output results.json [--compare previous.json]
+#
+# Neither an internet connection nor Redis is required, the tasks are called directly. All data is written to a separate
+# "universs_ingest" database (see --database), which is reset before every round and dropped at the end of the run.
+# Results are saved as JSON (including the current commit), --compare prints the change of every metric.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from time import perf_counter
+from datetime import datetime
+from multiprocessing import Process
+from resource import getrusage, RUSAGE_SELF
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, p):
+    ''' Returns the p-th percentile (nearest rank) of the values. '''
+
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))]
+
+def commit():
+    ''' Returns the current commit of the repository (or None). '''
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)), stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def reset(db, feeds):
+    ''' Removes all articles and (re-)creates the feeds, i.e. every round does the same work. '''
+
+    # The watermarks would skip all entries seen in the previous round, the runs of the previous rounds are of no interest
+    for name in ('articles', 'downloads', 'feeds', 'tags', 'state', 'watermarks', 'runs'):
+        db[name].drop()
+    db.feeds.insert_many([{
+        '_id' : feedid, 'title' : title, 'url' : url, 'tags' : ['tag-%d' % (i % 20)], 'description' : '', 'whitelist' : [], 'blacklist' : [], 'active' : True,
+        'total-articles' : 0, 'visible-articles' : 0, 'unread-articles' : 0, 'marked-articles' : 0, 'starred-articles' : 0
+    } for i, (title, url, feedid) in enumerate(feeds)])
+
+def report(results, previous = None):
+    ''' Prints a table of all stages (and the relative change to a previous run). '''
+
+    print('%-10s %10s %12s %12s %10s %10s' % ('Stage', 'Feeds/s', 'Articles/s', 'Articles', 'p50 [s]', 'p99 [s]'))
+    for stage, metrics in results['stages'].items():
+        line = '%-10s %10.1f %12.1f %12d %10.3f %10.3f' % (stage, metrics['feeds/s'], metrics['articles/s'], metrics['articles'], metrics['p50'], metrics['p99'])
+        if previous and stage in previous['stages']:
+            before = previous['stages'][stage]
+            line += '   p50 %+.1f%%, articles/s %+.1f%%' % tuple(100.0 * (metrics[key] - before[key]) / before[key] if before[key] else 0.0 for key in ('p50', 'articles/s'))
+        print(line)
+    print('Peak RSS: %.1f MB%s' % (results['peak-rss'], ' (before: %.1f MB)' % previous['peak-rss'] if previous else ''))
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the ingest pipeline.')
+    parser.add_argument('--server', default = 'localhost')
+    parser.add_argument('--database', default = 'universs_ingest')
+    parser.add_argument('--feeds', type = int, default = 1000)
+    parser.add_argument('--rounds', type = int, default = 5)
+    parser.add_argument('--port', type = int, default = 8900)
+    parser.add_argument('--hosts', type = int, default = 50, help = 'Number of hosts (ports) the feeds are spread over')
+    parser.add_argument('--latency', type = float, default = 0.05, help = 'Mean latency per response in seconds')
+    parser.add_argument('--jitter', type = float, default = 0.5, help = 'Standard deviation of the latency relative to its mean')
+    parser.add_argument('--errors', type = float, default = 0.01, help = 'Fraction of failed responses')
+    parser.add_argument('--entries', type = int, default = 20, help = 'Median number of entries per feed')
+    parser.add_argument('--size', type = int, default = 2000, help = 'Mean size of an entry in bytes')
+    parser.add_argument('--atom', type = float, default = 0.3, help = 'Fraction of Atom feeds')
+    parser.add_argument('--output', help = 'Save the results as JSON')
+    parser.add_argument('--compare', help = 'Results of a previous run (JSON)')
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the benchmark database')
+    args = parser.parse_args()
+
+    # The tasks connect to the database on their own, this has to be set before universs is imported
+    os.environ['UNIVERSS_DATABASE'] = args.database
+
+    from fetch import wait
+    from farm import serve, urls
+    from universs import FETCH_CONCURRENCY
+    from universs.base import client
+    from universs.rss import pull
+    from universs.tasks import entry, download, process
+
+    settings = {'jitter' : args.jitter, 'errors' : args.errors, 'variable' : True, 'atom' : args.atom}
+    server = Process(target = serve, args = (args.feeds, args.port, '127.0.0.1', args.latency, args.entries, args.size, True, args.hosts), kwargs = settings, daemon = True)
+    server.start()
+
+    # Not base.init(), that would import the default subscriptions into the empty database
+    db = client(args.server)[args.database]
+    feeds = urls(args.feeds, args.port, hosts = args.hosts)
+    timings = {'pull' : [], 'download' : [], 'process' : []}
+    counts = {stage : 0 for stage in timings}
+
+    try:
+        wait(args.port)
+        for i in range(args.rounds):
+            reset(db, feeds)
+
+            start = perf_counter()
+            counts['pull'] = len(pull(feeds, FETCH_CONCURRENCY, timeout = 3, verbose = 0))
+            timings['pull'].append(perf_counter() - start)
+
+            start = perf_counter()
+            counts['download'] = download([entry(feed) for feed in db.feeds.find()])
+            timings['download'].append(perf_counter() - start)
+
+            start = perf_counter()
+            counts['process'] = process()
+            timings['process'].append(perf_counter() - start)
+
+            print('Round %d/%d: %s' % (i + 1, args.rounds, ', '.join('%s %.2fs' % (stage, values[-1]) for stage, values in timings.items())))
+    finally:
+        server.terminate()
+        if not args.keep:
+            db.client.drop_database(args.database)
+
+    results = {
+        'commit' : commit(), 'date' : datetime.utcnow().isoformat(), 'arguments' : vars(args), 'stages' : {},
+        # Peak resident set size of this process (the tasks run here, the feed farm runs in its own process)
+        'peak-rss' : getrusage(RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+    for stage, values in timings.items():
+        p50 = percentile(values, 50)
+        results['stages'][stage] = {
+            'p50' : p50, 'p99' : percentile(values, 99), 'articles' : counts[stage],
+            # Process doesn't fetch any feeds, but its articles stem from all of them
+            'feeds/s' : len(feeds) / p50, 'articles/s' : counts[stage] / p50,
+        }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    report(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Compares the single-parse normalization (universs.normalize) with the former three-parser pipeline, i.e.
+# BeautifulSoup for the text, lxml's Cleaner for the HTML and htmlmin for the minification.
+#
+# Usage: python benchmarks/normalize.py --articles 2000 --size 20000
+#
+# Requires beautifulsoup4 and htmlmin (for the former pipeline only). Both pipelines are run on a golden corpus of
+# edge cases plus synthetic articles, the outputs are compared (HTML as serialized, modulo attribute quoting; text modulo
+# whitespace) and timed.
+
+import argparse
+import random
+import re
+
+from time import perf_counter
+from resource import getrusage, RUSAGE_SELF
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+from htmlmin import minify as htmlmin
+from lxml.etree import Error
+
+from universs.normalize import normalize, cleaner
+
+GOLDEN = [
+    '',
+    'Plain text without any markup',
+    '<p>Hello <b>world</b>!</p>',
+    '<div>\n  <p>a   b</p>\n  <p> c </p>\n</div>',
+    '<p class="lead" align="center" style="color: red">Styled</p>',
+    '<p>Before</p><script>alert("x");</script><p>After</p>',
+    '<form action="/x"><input type="text" name="q"><button>Go</button></form><p>Form</p>',
+    '<p>Comment <!-- hidden --> here</p>',
+    '<pre>  keep\n    this   whitespace</pre><p>but   not   this</p>',
+    '<p>Entities: &amp; &lt; &gt; &quot; &#8364; &euro;</p>',
+    '<a href="http://example.com" onclick="evil()" target="_blank">Link</a>',
+    '<img src="a.png" alt="" hspace="5" vspace="5"><br/>Caption',
+    '<table><tr><td valign="top">1</td><td>2</td></tr></table>',
+    '<ul>\n<li>One</li>\n<li>Two</li>\n</ul>',
+    '<html><head><title>T</title><meta charset="utf-8"></head><body><p>Full document</p></body></html>',
+    '<iframe src="http://example.com"></iframe><p>Embedded</p>',
+    '<p>Unclosed <b>bold <i>italic</p>',
+    '<span>a</span> <span>b</span>',
+    '<blockquote>\n\tQuote\n</blockquote>',
+    '<textarea>  raw\n text </textarea>',
+]
+
+WORDS = 'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore'.split()
+
+def synthetic(n, size):
+    ''' Returns n synthetic article bodies of roughly the given mean size. '''
+
+    rng, articles = random.Random(n), []
+    for _ in range(n):
+        paragraphs = []
+        while sum(map(len, paragraphs)) < rng.expovariate(1 / size):
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))
+            paragraphs.append(rng.choice([
+                '<p class="x">%s</p>\n', '<p>%s <a href="http://example.com" class="y">link</a></p>\n',
+                '<div align="left">\n  <span>%s</span>\n</div>\n', '<ul>\n  <li>%s</li>\n</ul>\n', '<!-- ad -->%s<br>\n'
+            ]) % words)
+        articles.append(''.join(paragraphs))
+    return articles
+
+def legacy(content):
+    ''' The former pipeline: rss._post_process() and tasks.process(). '''
+
+    text = BeautifulSoup(content, 'lxml').get_text().strip()
+    try:
+        content = cleaner().clean_html(content)
+    except Error:
+        pass
+    return htmlmin(content, remove_empty_space = True, reduce_boolean_attributes = True).strip(), text
+
+# Tags and their attributes (name and a double-quoted, single-quoted or unquoted value)
+TAG = re.compile(r'<[^>]+>')
+ATTRIBUTE = re.compile(r'''(\s[^\s=<>"'/]+)=(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))''')
+
+def quote(match):
+    ''' Returns an attribute with its value in double quotes. '''
+
+    name, double, single, bare = match.groups()
+    value = double if double is not None else (single.replace('"', '&quot;') if single is not None else bare)
+    return '%s="%s"' % (name, value)
+
+def canonical(html):
+    ''' Returns the serialized HTML with all attribute values in double quotes, i.e. whitespace (minification) still counts. '''
+    return TAG.sub(lambda match: ATTRIBUTE.sub(quote, match.group(0)), html)
+
+def compare(corpus):
+    ''' Returns the number of differences in HTML and text between both pipelines. '''
+
+    html, text = 0, 0
+    for content in corpus:
+        a, b = legacy(content), normalize(content)
+        html += canonical(a[0]) != canonical(b[0])
+        # The text used to include everything the cleaner removes (scripts, form controls, ...),
+        # now it is the text of the cleaned content, i.e. what is actually shown to the reader
+        try:
+            reference = BeautifulSoup(cleaner().clean_html(content), 'lxml').get_text()
+        except Error:
+            reference = a[1]
+        text += ' '.join(reference.split()) != ' '.join(b[1].split())
+    return html, text
+
+def measure(f, corpus):
+    ''' Returns the throughput in articles/s and the increase of the peak memory (RSS) in MB. '''
+
+    # Most of the memory is allocated by libxml2, i.e. it is not visible to tracemalloc
+    before = getrusage(RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    for content in corpus:
+        f(content)
+    elapsed = perf_counter() - start
+
+    return len(corpus) / elapsed, (getrusage(RUSAGE_SELF).ru_maxrss - before) / 1024.0
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the HTML normalization.')
+    parser.add_argument('--articles', type = int, default = 2000)
+    parser.add_argument('--size', type = int, default = 20000, help = 'Mean size of an article body in bytes')
+    args = parser.parse_args()
+
+    corpus = GOLDEN + synthetic(args.articles, args.size)
+    html, text = compare(corpus)
+    print('Corpus: %d articles • differences: %d (HTML), %d (text)' % (len(corpus), html, text))
+
+    print('%-10s %16s %12s' % ('Pipeline', 'Articles/s', 'Peak [MB]'))
+    for name, f in (('legacy', legacy), ('normalize', normalize)):
+        # Every pipeline runs in a fresh process, so that the peak memory can be compared
+        with ProcessPoolExecutor(1) as pool:
+            throughput, peak = pool.submit(measure, f, corpus).result()
+        print('%-10s %16.1f %12.1f' % (name, throughput, peak))
+
+if __name__ == '__main__':
+    main()
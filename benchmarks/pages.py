@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Measures the bytes on the wire and the server time of the article list pages (100 articles per page): uncompressed as
+# before, compressed (gzip, brotli if installed) and revalidated with If-None-Match (304). The size of the documents read
+# from MongoDB per page is shown with and without the article bodies (which are loaded one at a time, see /articles/<id>).
+#
+# Usage: python benchmarks/pages.py --articles 100000 [--server localhost]
+#
+# This needs a running (local) mongod, the pages are requested through Flask's test client (i.e. without network).
+# All data is written to a separate "universs_pages" database, which is dropped at the end of the run unless --keep is given.
+
+import argparse
+import os
+import sys
+
+from time import perf_counter
+from statistics import median
+
+from bson import BSON
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Transfer encodings and request headers per case, "plain" is what every page load cost before
+CASES = [
+    ('plain', {'Accept-Encoding' : 'identity'}),
+    ('gzip', {'Accept-Encoding' : 'gzip'}),
+    ('br', {'Accept-Encoding' : 'br'}),
+    ('304', {'Accept-Encoding' : 'br, gzip'}),
+]
+
+def measure(client, url, headers, repeat):
+    ''' Returns the median time (in milliseconds) and the size of the body (in bytes) of a request. '''
+
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        response = client.get(url, headers = headers)
+        timings.append((perf_counter() - start) * 1000)
+    return median(timings), len(response.get_data()), response
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the article list pages on the wire.')
+    parser.add_argument('--server', default = 'localhost')
+    parser.add_argument('--database', default = 'universs_pages')
+    parser.add_argument('--articles', type = int, default = 100000)
+    parser.add_argument('--repeat', type = int, default = 20)
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the benchmark database')
+    args = parser.parse_args()
+
+    # The views connect to the database on their own, this has to be set before universs is imported
+    os.environ['UNIVERSS_DATABASE'] = args.database
+
+    from universs import app
+    from universs.base import client, PROJECTION
+    from universs.views import brotli
+    from query import seed
+
+    db = client(args.server)[args.database]
+    if db.articles.estimated_document_count() != args.articles:
+        print('Seeding %d articles...' % args.articles)
+        seed(db, args.articles)
+    # Feeds and tags as referenced by the seeded articles (feed-<n> and tag-<n>), with zeroed counters
+    for name, n in (('feeds', 500), ('tags', 20)):
+        db[name].drop()
+        db[name].insert_many([{'_id' : '%s-%d' % (name[:-1], i), 'title' : '%s-%d' % (name[:-1], i), 'url' : '', 'tags' : [], 'feeds' : [],
+                               'active' : True, 'unread-articles' : 0, 'visible-articles' : 0} for i in range(n)])
+
+    client = app.test_client()
+    pages = [('all feeds', '/feeds?all'), ('one feed', '/feeds/show/feed-1?all'), ('one tag', '/tags/tag-1?all')]
+
+    print('%-10s %-6s %12s %10s' % ('Page', 'Case', 'Bytes', 'Time [ms]'))
+    for name, url in pages:
+        etag = None
+        for case, headers in CASES:
+            if case == 'br' and brotli is None:
+                continue
+            if case == '304':
+                headers = dict(headers, **{'If-None-Match' : etag})
+            milliseconds, size, response = measure(client, url, headers, args.repeat)
+            etag = response.headers.get('ETag')
+            print('%-10s %-6s %12d %10.1f' % (name, case, size, milliseconds))
+
+    # Documents transferred from MongoDB for one page of articles, with and without the bodies
+    for name, projection in (('bodies', None), ('headers', PROJECTION)):
+        size = sum(len(BSON.encode(article)) for article in db.articles.find(projection = projection, limit = 100))
+        print('%-10s %-6s %12d' % ('documents', name, size))
+
+    if not args.keep:
+        db.client.drop_database(args.database)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Compares the fast feed parser (universs/parser.py, lxml) with feedparser: all documents of the corpus must result in
+# the same articles (after rss._post_process() and normalize()), and the time per MB of feed XML is measured for both.
+#
+# Usage: python benchmarks/parse.py --feeds 500 --size 2000 [--atom 0.3]
+#
+# The corpus consists of synthetic feeds (benchmarks/farm.py) and the hand-written documents below, which cover the
+# corner cases of both formats. No database is required, the script exits with status 1 if any document differs.
+
+import argparse
+import os
+import sys
+
+from time import perf_counter
+
+import feedparser
+import pytz
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from farm import generate
+from universs.normalize import normalize
+from universs.parser import parse, ERRORS
+from universs.rss import _extract, _post_process
+
+EDGES = [
+    # Namespaces, CDATA, entities, dc:creator/dc:date, GUIDs that are (not) links, dates with named timezones
+    b'''<?xml version="1.0" encoding="UTF-8"?><rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <channel><title>Edge &amp; Cases</title><link>http://example.com/</link><language>de</language>
+    <item><title>A &amp;amp; B</title><guid>http://example.com/1</guid><author>a@example.com (Alice)</author><pubDate>Tue, 31 Dec 2019 23:00:00 EST</pubDate>
+    <description>Summary &lt;script&gt;alert(1)&lt;/script&gt;</description><content:encoded><![CDATA[<p style="color: red" onclick="x()">Caf&eacute; <a href="/relative">link</a></p>]]></content:encoded></item>
+    <item><title>  Second  </title><guid isPermaLink="false">id-2</guid><dc:creator>Bob</dc:creator><dc:date>2020-01-01T10:00:00+02:00</dc:date><description>Caf&#233; &quot;quoted&quot;</description></item>
+    <item><title><![CDATA[Third & last]]></title><link>http://example.com/3</link><pubDate>Wed, 01 Jan 2020 08:00:00</pubDate></item>
+    <item><description>No title</description></item>
+    </channel></rss>''',
+    # Atom: xml:lang, xhtml/text/html content, link relations, entries without links, fractional seconds, dates without time
+    b'''<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom" xml:lang="en"><title type="html">Atom &amp;amp; Edges</title>
+    <link rel="self" href="http://example.com/atom.xml"/><link href="http://example.com/"/><id>urn:feed</id><updated>2020-01-02T00:00:00Z</updated>
+    <entry><title type="html">Hi &amp;amp; bye</title><link rel="enclosure" href="http://example.com/a.mp3"/><link href="http://example.com/1"/><id>urn:1</id>
+    <author><name>Carol</name><email>c@example.com</email></author><published>2020-01-01T10:00:00.5+02:00</published><updated>2020-01-02</updated>
+    <summary>Summary</summary><content type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml"><p>x <b>y</b></p> tail</div></content></entry>
+    <entry xml:lang="de"><title>Plain</title><id>urn:2</id><updated>2020-01-01T00:00:00Z</updated><content type="text">a &lt; b</content></entry>
+    <entry><title>Only a summary</title><id>http://example.com/3</id><updated>2019-12-31T12:00:00-05:00</updated><summary type="html">&lt;p&gt;Text&lt;/p&gt;</summary></entry>
+    </feed>''',
+    # Falls back to feedparser: relative links (of entries and in their content) resolved against xml:base
+    b'''<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom" xml:base="https://blog.example.com/"><title>Base</title>
+    <link href="/"/><id>urn:base</id><updated>2020-01-02T00:00:00Z</updated>
+    <entry><title>Relative</title><link href="2020/post"/><id>urn:1</id><updated>2020-01-01T00:00:00Z</updated>
+    <content type="html">&lt;p&gt;&lt;a href="2020/other"&gt;Other&lt;/a&gt; &lt;img src="/a.png"/&gt;&lt;/p&gt;</content></entry>
+    <entry xml:base="https://elsewhere.example.com/blog/"><title>Nested</title><link href="post"/><id>urn:2</id><updated>2020-01-01T00:00:00Z</updated></entry>
+    </feed>''',
+    b'''<?xml version="1.0" encoding="UTF-8"?><rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/">
+    <channel><title>Base</title><link>http://example.com/</link>
+    <item xml:base="http://example.com/blog/"><title>Relative</title><link>http://example.com/blog/1</link>
+    <content:encoded><![CDATA[<a href="2">Next</a>]]></content:encoded></item></channel></rss>''',
+    # Falls back to feedparser: RSS 1.0 (RDF), unescaped markup in a title, malformed XML
+    b'''<?xml version="1.0"?><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns="http://purl.org/rss/1.0/">
+    <channel rdf:about="http://example.com/"><title>RDF</title><link>http://example.com/</link></channel>
+    <item rdf:about="http://example.com/1"><title>RDF item</title><link>http://example.com/1</link><description>Text</description></item></rdf:RDF>''',
+    b'''<rss version="2.0"><channel><title>Markup</title><item><title>&lt;script&gt;x&lt;/script&gt; Title</title><link>http://example.com/1</link></item></channel></rss>''',
+    b'''<rss version="2.0"><channel><title>Broken</title><item><title>Unclosed & ampersand</title><link>http://example.com/1</link></item></channel>''',
+]
+
+# Fields of the post-processed articles that are compared, the content is compared after cleaning (see normalize)
+FIELDS = ('title', 'link', 'author', 'language', 'date', 'id', 'feed-name', 'feed-url')
+
+# Articles without a (valid) publishing date are dated at the time of parsing, these dates are not compared
+STARTED = pytz.utc.localize(datetime.utcnow())
+
+def articles(feed):
+    ''' Returns the post-processed articles of a parsed feed (as they would be queued by the download task). '''
+
+    articles, *_ = _extract(feed)
+    return [dict(article, content = normalize(article['content'])) for article in _post_process(articles)]
+
+def fast(content):
+    ''' Parses a document with the fast parser, returns None if it falls back to feedparser. '''
+
+    try:
+        return articles(parse(content))
+    except ERRORS:
+        return None
+
+def compare(content):
+    ''' Returns the differences between both parsers for a document (and whether the fast parser handled it). '''
+
+    expected, actual = articles(feedparser.parse(content)), fast(content)
+    if actual is None:
+        return [], False
+    if len(expected) != len(actual):
+        return ['%d instead of %d articles' % (len(actual), len(expected))], True
+
+    differences = []
+    for a, b in zip(expected, actual):
+        if a['date'] >= STARTED and b['date'] >= STARTED:
+            a['date'] = b['date']
+        differences += ['%s: %r != %r' % (key, a.get(key), b.get(key)) for key in FIELDS + ('content',) if a.get(key) != b.get(key)]
+    return differences, True
+
+def timeit(function, contents, repeat):
+    ''' Returns the best time (in seconds) of parsing all documents with a function. '''
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        for content in contents:
+            for entry in function(content)['entries']:
+                pass
+        best = min(best, perf_counter() - start)
+    return best
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Compare the fast feed parser with feedparser.')
+    parser.add_argument('--feeds', type = int, default = 500)
+    parser.add_argument('--entries', type = int, default = 20, help = 'Median number of entries per feed')
+    parser.add_argument('--size', type = int, default = 2000, help = 'Mean size of an entry in bytes')
+    parser.add_argument('--atom', type = float, default = 0.3, help = 'Fraction of Atom feeds')
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+
+    contents = [generate(n, args.entries, args.size, True, args.atom) for n in range(args.feeds)]
+
+    failures, handled = 0, 0
+    for i, content in enumerate(EDGES + contents):
+        differences, fast_path = compare(content)
+        handled += fast_path
+        if differences:
+            failures += 1
+            print('Document %d differs:\n  %s' % (i, '\n  '.join(differences[:10])))
+    print('Equivalence: %d documents, %d parsed by the fast path, %d differ' % (len(EDGES) + len(contents), handled, failures))
+
+    megabytes = sum(len(content) for content in contents) / 1024.0**2
+    seconds = {'feedparser' : timeit(feedparser.parse, contents, args.repeat), 'lxml' : timeit(parse, contents, args.repeat)}
+    print('Corpus: %d feeds, %.1f MB of XML' % (len(contents), megabytes))
+    for name, t in seconds.items():
+        print('%-10s %8.3f s/MB %8.1f MB/s' % (name, t / megabytes, megabytes / t))
+    print('Speedup: %.1fx' % (seconds['feedparser'] / seconds['lxml']))
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
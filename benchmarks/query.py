@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Measures the page latency of base.get() against the former "$out" query path.
+#
+# Usage: python benchmarks/query.py --articles 1000000 [--server localhost]
+#
+# This needs a running (local) mongod. All data is written to a separate "universs_benchmark" database,
+# which is dropped at the end of the run unless --keep is given.
+
+import argparse
+import random
+
+from math import ceil
+from time import perf_counter
+from datetime import datetime, timedelta
+from hashlib import md5
+from statistics import median
+
+import pytz
+
+from pymongo import MongoClient
+
+from universs import DEFAULT_PAGE_LIMIT, DEFAULT_SORT
+from universs.base import get, _match
+from universs.indexes import reconcile
+
+def seed(db, n, feeds = 500, chunk = 10000):
+    ''' Fills the articles collection with n synthetic articles. '''
+
+    db.articles.drop()
+    now = pytz.utc.localize(datetime.utcnow())
+    tags = ['tag-%d' % i for i in range(20)]
+    feedids = ['feed-%d' % i for i in range(feeds)]
+
+    for start in range(0, n, chunk):
+        articles = []
+        for i in range(start, min(n, start + chunk)):
+            feedid = random.choice(feedids)
+            articles.append({
+                '_id' : md5(('%s - %d' % (feedid, i)).encode('utf-8')).hexdigest(),
+                'feed-id' : feedid, 'feed-name' : feedid, 'tags' : random.sample(tags, 2),
+                'title' : 'Article %d' % i, 'link' : 'http://localhost/%d' % i, 'author' : '', 'language' : '',
+                'content' : '<p>%s</p>' % ('Lorem ipsum dolor sit amet. ' * 40), 'text' : 'Lorem ipsum dolor sit amet. ' * 40,
+                'date' : now - timedelta(minutes = i), 'downloaded' : now,
+                'show' : True, 'read' : random.random() < 0.7, 'marked' : random.random() < 0.02, 'starred' : random.random() < 0.01
+            })
+        db.articles.insert_many(articles, ordered = False)
+
+    # Same indexes as in production
+    reconcile(db)
+
+def legacy(db, query):
+    ''' The former implementation of base.get(), which writes all matches to a temporary collection. '''
+
+    match = _match(query)
+    offset, limit = query.get('offset', 0), query.get('limit', DEFAULT_PAGE_LIMIT)
+    order = 1 if 'reversed' in query else -1
+    pipeline = [{'$match' : match}, {'$sort' : {query.get('sort', DEFAULT_SORT) : order}}, {'$out' : 'output'}]
+    db.articles.aggregate(pipeline, allowDiskUse = True)
+    cursor = db.output.find(skip = offset, limit = limit)
+
+    response = {k : v for k, v in query.items()}
+    response['total'] = db.output.count_documents({})
+    response['pages'] = ceil(response['total'] / limit)
+    response['results'] = list(cursor)
+    response['size'] = len(response['results'])
+    db.output.drop()
+
+    return response
+
+def measure(f, db, query, repeat):
+    ''' Returns the median latency of f(db, query) in milliseconds. '''
+
+    timings = []
+    for _ in range(repeat):
+        t = perf_counter()
+        f(db, dict(query))
+        timings.append((perf_counter() - t) * 1000)
+    return median(timings)
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark article list queries.')
+    parser.add_argument('--server', default = 'localhost')
+    parser.add_argument('--articles', type = int, default = 1000000)
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--skip-legacy', action = 'store_true', help = 'Do not run the (slow) $out implementation')
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the benchmark database')
+    args = parser.parse_args()
+
+    db = MongoClient(args.server, tz_aware = True).universs_benchmark
+    if db.articles.estimated_document_count() != args.articles:
+        print('Seeding %d articles...' % args.articles)
+        seed(db, args.articles)
+
+    limit = DEFAULT_PAGE_LIMIT
+    base = {'show' : True, 'sort' : DEFAULT_SORT, 'limit' : limit}
+    shapes = [
+        ('all, unread', dict(base, read = False)),
+        ('all, every article', dict(base, all = True)),
+        ('feed, default', dict(base, **{'feed-id' : 'feed-1', 'default' : True, 'read' : False})),
+        ('tag, unread', dict(base, tags = 'tag-1', read = False)),
+    ]
+
+    print('%-24s %6s %12s %12s' % ('Query', 'Page', 'get() [ms]', '$out [ms]'))
+    for name, query in shapes:
+        for page in (1, 10, 100):
+            query['offset'] = (page - 1) * limit
+            current = measure(get, db, query, args.repeat)
+            old = measure(legacy, db, query, 1) if not args.skip_legacy else float('nan')
+            print('%-24s %6d %12.1f %12.1f' % (name, page, current, old))
+
+    if not args.keep:
+        db.client.drop_database(db.name)
+
+if __name__ == '__main__':
+    main()
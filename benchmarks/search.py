@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Measures the latency of the full-text search (base.search) on a synthetic corpus.
+#
+# Usage: python benchmarks/search.py --articles 1000000 [--server localhost]
+#
+# This needs a running (local) mongod. All data is written to a separate "universs_search" database,
+# which is dropped at the end of the run unless --keep is given. Words are drawn from a Zipf distribution,
+# i.e. the queries cover rare, medium and frequent terms; the target is a median below 100ms for every query.
+
+import argparse
+import random
+
+from time import perf_counter
+from datetime import datetime, timedelta
+from statistics import median
+
+import pytz
+
+from pymongo import MongoClient
+
+from universs.base import search
+from universs.indexes import reconcile
+
+TARGET = 100.0
+
+def vocabulary(n):
+    ''' Returns n distinct pseudo-words, the first ones are the most frequent. '''
+
+    rng, syllables = random.Random(n), ['ka', 'lo', 'mi', 'ner', 'sto', 'ul', 'ba', 'tre', 'gen', 'ho', 'pri', 'sa', 'ven', 'da']
+    words = set()
+    while len(words) < n:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key = lambda word: (len(word), word))
+
+def seed(db, n, words, feeds = 500, chunk = 10000):
+    ''' Fills the articles collection with n synthetic articles. '''
+
+    db.articles.drop()
+    rng, now = random.Random(0), pytz.utc.localize(datetime.utcnow())
+    # Zipf-like weights, i.e. the k-th word is k times less frequent than the first one
+    weights = [1.0 / (k + 1) for k in range(len(words))]
+
+    for start in range(0, n, chunk):
+        articles = []
+        for i in range(start, min(n, start + chunk)):
+            feedid = 'feed-%d' % rng.randrange(feeds)
+            text = rng.choices(words, weights, k = 80)
+            articles.append({
+                '_id' : '%s-%d' % (feedid, i), 'feed-id' : feedid, 'feed-name' : feedid, 'tags' : ['tag-%d' % (i % 20)],
+                'title' : ' '.join(text[:6]).capitalize(), 'text' : ' '.join(text), 'content' : '<p>%s</p>' % ' '.join(text),
+                'date' : now - timedelta(minutes = i), 'downloaded' : now,
+                'show' : True, 'read' : rng.random() < 0.7, 'marked' : False, 'starred' : False
+            })
+        db.articles.insert_many(articles, ordered = False)
+
+    # Same indexes as in production, including the text index
+    reconcile(db)
+
+def measure(db, query, repeat):
+    ''' Returns the median latency of base.search() in milliseconds and the number of results. '''
+
+    timings = []
+    for _ in range(repeat):
+        t = perf_counter()
+        response = search(db, dict(query))
+        timings.append((perf_counter() - t) * 1000)
+    return median(timings), response['size']
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the full-text search.')
+    parser.add_argument('--server', default = 'localhost')
+    parser.add_argument('--articles', type = int, default = 1000000)
+    parser.add_argument('--words', type = int, default = 50000, help = 'Size of the vocabulary')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the benchmark database')
+    args = parser.parse_args()
+
+    words = vocabulary(args.words)
+    db = MongoClient(args.server, tz_aware = True).universs_search
+    if db.articles.estimated_document_count() != args.articles:
+        print('Seeding %d articles...' % args.articles)
+        seed(db, args.articles, words)
+
+    base = {'show' : True, 'all' : True, 'limit' : 20, 'offset' : 0, 'sort' : 'relevance'}
+    rare, medium, frequent = words[-1], words[len(words) // 100], words[10]
+    shapes = [
+        ('rare word', dict(base, search = rare)),
+        ('medium word', dict(base, search = medium)),
+        ('frequent word', dict(base, search = frequent)),
+        ('two words', dict(base, search = '%s %s' % (medium, rare))),
+        ('phrase', dict(base, search = '"%s %s"' % (words[0], words[1]))),
+        ('medium, by date', dict(base, search = medium, sort = 'date')),
+        ('medium, unread', dict(base, search = medium, read = False, all = False)),
+        ('medium, one feed', dict(base, search = medium, **{'feed-id' : 'feed-1'})),
+        ('medium, page 10', dict(base, search = medium, offset = 180)),
+    ]
+
+    print('%-20s %10s %12s %6s' % ('Query', 'Results', 'Median [ms]', ''))
+    for name, query in shapes:
+        latency, size = measure(db, query, args.repeat)
+        print('%-20s %10d %12.1f %6s' % (name, size, latency, 'ok' if latency < TARGET else 'SLOW'))
+
+    if not args.keep:
+        db.client.drop_database(db.name)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Measures the storage and read-latency impact of compressed article bodies (see STORAGE_COMPRESSION): the same corpus
+# is written once per format (plain, zlib, zstd if installed) and the data size, the storage size and the latency of
+# reading single bodies (like /articles/<id>) are reported.
+#
+# Usage: python benchmarks/storage.py --feeds 200 --size 5000 [--fields content text] [--server localhost]
+#
+# This needs a running (local) mongod. All data is written to a separate "universs_storage" database, which is dropped
+# at the end of the run unless --keep is given. The corpus consists of synthetic feeds (benchmarks/farm.py).
+
+import argparse
+import os
+import random
+import sys
+
+from time import perf_counter
+from datetime import datetime
+from statistics import median
+
+import pytz
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from farm import generate
+from universs.rss import _process
+from universs.tasks import prepare_all
+from universs.storage import pack, unpack, zstandard
+
+def corpus(feeds, entries, size):
+    ''' Returns the articles of synthetic feeds as they would be written by the process task (uncompressed). '''
+
+    now = pytz.utc.localize(datetime.utcnow())
+    articles = [article for n in range(feeds) for article in _process(generate(n, entries, size), 'feed-%d' % n)]
+    for i, article in enumerate(articles):
+        article['_id'], article['feed-id'] = str(i), 'feed'
+    return [unpack(article) for article in prepare_all(articles, {'feed' : []}, now)]
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark compressed storage of article bodies.')
+    parser.add_argument('--server', default = 'localhost')
+    parser.add_argument('--database', default = 'universs_storage')
+    parser.add_argument('--feeds', type = int, default = 200)
+    parser.add_argument('--entries', type = int, default = 20, help = 'Number of entries per feed')
+    parser.add_argument('--size', type = int, default = 5000, help = 'Mean size of an article body in bytes')
+    parser.add_argument('--fields', nargs = '+', default = ['content'], help = 'Fields to compress')
+    parser.add_argument('--reads', type = int, default = 2000, help = 'Number of bodies read per format')
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the benchmark database')
+    args = parser.parse_args()
+
+    db = MongoClient(args.server)[args.database]
+    articles = corpus(args.feeds, args.entries, args.size)
+    print('Corpus: %d articles, %.1f MB of HTML' % (len(articles), sum(len(article['content']) for article in articles) / 1024.0**2))
+
+    formats = [None, 'zlib'] + (['zstd'] if zstandard else [])
+    projection = ('title', 'link', 'author', 'language', 'date', 'content', 'read', 'marked', 'starred')
+    uids = [article['_id'] for article in articles]
+
+    print('%-8s %12s %12s %12s %14s' % ('Format', 'Data [MB]', 'Disk [MB]', 'Write [s]', 'Read [ms/body]'))
+    for name in formats:
+        collection = db['articles_%s' % (name or 'plain')]
+        collection.drop()
+
+        start = perf_counter()
+        collection.insert_many([pack(dict(article), name, args.fields) for article in articles], ordered = False)
+        writing = perf_counter() - start
+
+        # Random single reads, including the decompression
+        timings = []
+        for uid in random.sample(uids, min(args.reads, len(uids))):
+            start = perf_counter()
+            unpack(collection.find_one({'_id' : uid}, projection = projection))
+            timings.append((perf_counter() - start) * 1000)
+
+        stats = db.command('collstats', collection.name)
+        print('%-8s %12.1f %12.1f %12.2f %14.3f' % (name or 'plain', stats['size'] / 1024.0**2, stats['storageSize'] / 1024.0**2, writing, median(timings)))
+
+    if not args.keep:
+        db.client.drop_database(args.database)
+
+if __name__ == '__main__':
+    main()
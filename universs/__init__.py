@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import os
+
 from flask import Flask
 from celery import Celery
 
@@ -12,12 +14,61 @@ app = Flask('universs')
 app.config['CELERY_BROKER_URL'] = 'redis://localhost:6379'
 app.config['CELERY_RESULT_BACKEND'] = 'redis://localhost:6379'
 
+# Name of the MongoDB database (e.g. a separate one for benchmarks)
+MONGO_DATABASE = os.environ.get('UNIVERSS_DATABASE', 'universs')
+# MongoDB connection pool (per process) and timeouts in milliseconds
+MONGO_POOL_SIZE = 20
+MONGO_TIMEOUT = 5000
+
 DEFAULT_PAGE_LIMIT = 100
 DEFAULT_SORT = 'date'
 TIMEZONE = 'Europe/Berlin'
 TIMEFORMAT = '%d.%m.%Y, %H:%M:%S Uhr (%Z)'
 # Set this to 'unread' to only show unread articles by default
 SHOW_ONLY_UNREAD = 'unread'
+# Cache the total number of articles per query for this many seconds (0 means: always count exactly)
+COUNT_CACHE_TIMEOUT = 0
+# Set this to 'keyset' to paginate with (date, _id) cursors instead of page numbers (no total number of pages then)
+PAGINATION = 'offset'
+# Maximum number of concurrent connections when fetching feeds (overall and per host)
+FETCH_CONCURRENCY = 100
+FETCH_CONCURRENCY_PER_HOST = 4
+# Feeds are updated according to their publishing interval, but within these bounds (in seconds)
+SCHEDULE_MIN_INTERVAL = 600
+SCHEDULE_MAX_INTERVAL = 86400
+# Factor by which the interval grows if a feed had nothing new and the weight of a new observation
+SCHEDULE_BACKOFF = 1.5
+SCHEDULE_SMOOTHING = 0.5
+# Maximum number of feeds per scheduled update
+SCHEDULE_LIMIT = 200
+# Language of the full-text search index (stemming and stop words), e.g. 'english' or 'none'
+SEARCH_LANGUAGE = 'german'
+# Number of processes for CPU-bound work (parsing, cleaning, minification), 1 means serial processing
+# Note that every Celery worker process (of the default prefork pool) will start its own pool, i.e. choose this with
+# respect to --concurrency
+CPU_WORKERS = 1
+# Number of articles per work unit that is sent to a process
+CPU_CHUNK = 100
+
+# Number of entry IDs (GUIDs) per feed that are remembered, entries seen before are not parsed again (see rss._parse)
+WATERMARK_SIZE = 500
+
+# Number of articles in the RSS outputs of feeds, tags and starred articles (e.g. /output/tags/<title>.xml)
+OUTPUT_LIMIT = 50
+
+# Article lists are answered with 304 (Not Modified) while nothing changed, but at most for this many seconds (the time
+# stripes of the lists depend on the current time); responses of at least COMPRESS_MIN_SIZE bytes are compressed
+CONDITIONAL_TIMEOUT = 600
+COMPRESS_MIN_SIZE = 1024
+
+# Articles are stored with compressed bodies if this is 'zlib' or 'zstd' (needs the zstandard module, zlib otherwise),
+# existing articles are converted by the "universs.storage" task. Articles with a compressed "text" are not found by the
+# full-text search (except by their title), i.e. only add it to STORAGE_FIELDS if you don't use the search.
+STORAGE_COMPRESSION = None
+STORAGE_FIELDS = ('content',)
+
+# Size of the capped collection that keeps the records of the last pipeline runs (in bytes, see /metrics)
+RUNS_SIZE = 16 * 1024**2
 
 # Celery
 celery = Celery(app.import_name, backend = app.config['CELERY_RESULT_BACKEND'], broker = app.config['CELERY_BROKER_URL'])
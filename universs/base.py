@@ -1,29 +1,105 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import os
+
 from math import ceil
+from time import time
+from datetime import datetime
+from threading import Lock
 from uuid import uuid4 as uuid
-from pymongo import MongoClient
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as BinasciiError
+from bson import json_util, ObjectId
+from pymongo import MongoClient, ASCENDING, DESCENDING
 
-from universs import DEFAULT_PAGE_LIMIT, DEFAULT_SORT, SHOW_ONLY_UNREAD
-from universs.helpers import read_opml
+from universs import DEFAULT_PAGE_LIMIT, DEFAULT_SORT, SHOW_ONLY_UNREAD, COUNT_CACHE_TIMEOUT, PAGINATION, OUTPUT_LIMIT, MONGO_DATABASE, MONGO_POOL_SIZE, MONGO_TIMEOUT
+from universs.helpers import read_opml, canonical, keywords, snippet
+from universs.storage import unpack, decompress
 
-def init(server = 'localhost'):
-    ''' Establishes a connection to the database backend and returns a handle for the database. '''
+# One client (and thus one connection pool) per server and process, see init()
+_clients, _lock, _bootstrapped = {}, Lock(), False
+
+def _reset():
+    ''' Forgets all clients and state of the parent process (called in forked children). '''
+
+    global _clients, _lock, _bootstrapped
+    # MongoClient is not fork-safe, i.e. children (Celery prefork, flup) must open their own connections
+    _clients, _lock, _bootstrapped = {}, Lock(), False
+
+os.register_at_fork(after_in_child = _reset)
+
+def client(server = 'localhost'):
+    ''' Returns the (pooled) client of this process for the given server. '''
+
+    if server not in _clients:
+        with _lock:
+            if server not in _clients:
+                _clients[server] = MongoClient(server, tz_aware = True, maxPoolSize = MONGO_POOL_SIZE, connectTimeoutMS = MONGO_TIMEOUT, serverSelectionTimeoutMS = MONGO_TIMEOUT)
+    return _clients[server]
+
+def create_feeds(db, feeds):
+    ''' Creates all feeds from (title, url, folder) tuples whose URL isn't subscribed yet and returns the new feed IDs. '''
+
+    # Feeds are looked up by URL (to find duplicates) and by title (in all views), i.e. both have to be unique
+    urls, titles = set(), set()
+    for feed in db.feeds.find(projection = ('title', 'url')):
+        urls.add(canonical(feed['url']))
+        titles.add(feed['title'])
+
+    # A feed with several tags is listed once per tag folder (see views.opml_export), its tags are merged
+    documents = {}
+    for title, url, folder in feeds:
+        if not url or canonical(url) in urls:
+            continue
+        if canonical(url) in documents:
+            if folder and folder not in documents[canonical(url)]['tags']:
+                documents[canonical(url)]['tags'].append(folder)
+            continue
 
-    client = MongoClient(server, tz_aware = True)
-    db = client.universs
-    collections = db.collection_names()
+        unique, n = title, 1
+        while unique in titles:
+            n += 1
+            unique = '%s (%d)' % (title, n)
+        titles.add(unique)
 
-    if 'feeds' not in collections:
+        feed = {'_id' : str(uuid()), 'title' : unique, 'url' : url, 'tags' : [folder] if folder else [], 'description' : '', 'whitelist' : [], 'blacklist' : [], 'active' : True}
+        for key in ('total-articles', 'marked-articles', 'visible-articles', 'unread-articles'):
+            feed[key] = 0
+        documents[canonical(url)] = feed
+
+    # One round trip for all feeds
+    if documents:
+        db.feeds.insert_many(list(documents.values()), ordered = False)
+
+    return [feed['_id'] for feed in documents.values()]
+
+def bootstrap(db):
+    ''' Imports the initial feeds from an OPML file if there are no feeds yet. '''
+
+    if 'feeds' not in db.list_collection_names():
         subscriptions = 'data/subscriptions.xml'
-        feeds = read_opml(subscriptions)
-        db.feeds.insert_many([{'_id' : str(uuid()), 'title' : title, 'url' : url, 'tags' : [folder], 'description' : '', 'whitelist' : [], 'blacklist' : []} for title, url, folder in feeds])
+        create_feeds(db, read_opml(subscriptions))
+
+def init(server = 'localhost'):
+    ''' Returns a handle for the database (the connection pool is shared by all calls within a process). '''
+
+    global _bootstrapped
+
+    db = client(server)[MONGO_DATABASE]
+
+    # This only needs to be checked once per process, not on every request
+    if not _bootstrapped:
+        bootstrap(db)
+        _bootstrapped = True
 
     return db
 
-def get(db, query):
-    ''' Retrieves articles from the database backend. '''
+# Fields rendered in article lists, the bodies ("content") are loaded one at a time when an article is expanded (see article())
+PROJECTION = ('title', 'link', 'date', 'feed-id', 'feed-name', 'read', 'marked', 'starred')
+
+def _match(query):
+    ''' Translates the query dictionary into a MongoDB filter document. '''
 
     # Obtain a list of dictionaries containing all permitted flags
     if query.get('all', False):
@@ -33,6 +109,11 @@ def get(db, query):
     flags = [{key : query[key]} for key in filter(lambda x: x, query) if key in whitelist]
 
     match = {'$and' : []}
+    if 'show' in query:
+        # Hidden (filtered) articles are never listed, whatever the other flags say (this also bounds the index scan)
+        match['$and'].append(
+            {'show' : query['show']}
+        )
     if 'feed-id' in query:
         match['$and'].append(
             {'feed-id' : query['feed-id']}
@@ -59,75 +140,214 @@ def get(db, query):
         ]
     # Now: Append the rest of our conditions to the query...
     match['$and'].append({'$or' : conditions})
+
+    return match
+
+# Process-local cache for the total number of matched articles: {key : (timestamp, total)}, oldest first
+_counts, COUNTS_SIZE = {}, 1000
+
+def count(db, match, timeout = COUNT_CACHE_TIMEOUT):
+    ''' Counts the articles matching the filter document, optionally served from a short-lived cache. '''
+
+    if timeout <= 0:
+        return db.articles.count_documents(match)
+
+    key, now = repr(match), time()
+    if key in _counts:
+        timestamp, total = _counts.pop(key)
+        if now - timestamp < timeout:
+            _counts[key] = (timestamp, total)
+            return total
+
+    total = db.articles.count_documents(match)
+    # Every filter document is another key, i.e. expired entries are dropped and the cache never grows beyond COUNTS_SIZE
+    if len(_counts) >= COUNTS_SIZE:
+        for expired in [k for k, (timestamp, _) in _counts.items() if now - timestamp >= timeout]:
+            del _counts[expired]
+        while len(_counts) >= COUNTS_SIZE:
+            del _counts[next(iter(_counts))]
+    _counts[key] = (now, total)
+
+    return total
+
+# Types a sort key can have in a pagination token, anything else (e.g. {"$ne" : null}) would end up in the query
+CURSOR_TYPES = (type(None), bool, int, float, str, datetime, ObjectId)
+
+def encode_cursor(article, sort = DEFAULT_SORT):
+    ''' Returns an opaque pagination token for the (sort key, _id) position of an article. '''
+
+    value = json_util.dumps([article.get(sort), article['_id']])
+    # Padding is not needed to decode the token again and would only clutter the URL
+    return urlsafe_b64encode(value.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    ''' Returns the (value, _id) position encoded in a pagination token or None if the token is invalid. '''
+
+    try:
+        token = token + '=' * (-len(token) % 4)
+        cursor = json_util.loads(urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        value, uid = cursor if isinstance(cursor, list) else ()
+    except (ValueError, TypeError, UnicodeError, BinasciiError):
+        return None
+
+    # The token comes from the client, only plain values are used in the filter document
+    if not isinstance(value, CURSOR_TYPES) or not isinstance(uid, str):
+        return None
+
+    return value, uid
+
+def _seek(sort, cursor, order):
+    ''' Returns a filter document that matches all articles behind the cursor position in the given sort order. '''
+
+    value, uid = cursor
+    operator, bound = ('$gt', '$gte') if order == ASCENDING else ('$lt', '$lte')
+    # The (redundant) range on the sort key bounds the index scan, the $or alone can't be used for that
+    return {sort : {bound : value}, '$or' : [{sort : {operator : value}}, {sort : value, '_id' : {operator : uid}}]}
+
+def find(db, query):
+    ''' Returns the (not yet evaluated) cursor for one page of articles plus one more if needed, see get(). '''
+
+    match = _match(query)
+    offset, limit = query.get('offset', 0), query.get('limit', DEFAULT_PAGE_LIMIT)
+    key = query.get('sort', DEFAULT_SORT)
+    order = ASCENDING if 'reversed' in query else DESCENDING
+
+    # Keyset pagination: seek relative to the position of the first/last article of the current page instead of skipping
+    if query.get('before'):
+        # Walk backwards, the page is reversed again in get()
+        order = -order
+        match['$and'].append(_seek(key, query['before'], order))
+    elif query.get('after'):
+        match['$and'].append(_seek(key, query['after'], order))
+
+    # Break ties on the sort key by "_id", otherwise pages may overlap
+    sort = [(key, order), ('_id', order)]
+
+    # One additional article tells whether there is another page (without counting all of them)
+    counting = query.get('count', True)
+    n = limit + 1 if query.get('seek') or not counting else limit
+
+    # Read exactly one page, nothing is written to disk and concurrent requests don't share any state
+    projection = PROJECTION + (key,) if key not in PROJECTION else PROJECTION
+    return db.articles.find(match, projection = projection, sort = sort, skip = offset, limit = n)
+
+def get(db, query):
+    ''' Retrieves articles from the database backend. '''
+
     offset, limit = query.get('offset', 0), query.get('limit', DEFAULT_PAGE_LIMIT)
-    order = 1 if 'reversed' in query else -1
-
-    # This is an aggregation approach but currently fails for large number of articles due to memory limits.
-    # Even using allowDiskUse = True does not work as a workaround here.
-
-    # pipeline = [
-    #     {'$match' : match},
-    #     {'$sort' : {query.get('sort', DEFAULT_SORT) : order}},
-    #     # This is needed to count the total number of matched documents
-    #     {'$group' : {
-    #         '_id' : None,
-    #         'total' : {'$sum' : 1},
-    #         'results' : {'$limit' : 500, '$push' : '$$ROOT'}
-    #     }},
-    #     {'$project' : {
-    #         'total' : 1,
-    #         'results' : {
-    #             '$slice' : ['$results', offset, limit]
-    #         },
-    #     }},
-    #     {'$addFields' : {
-    #         'size' : {'$size' : '$results'},
-    #         'pages' : {'$ceil' : {'$divide' : ['$total', limit]}},
-    #         # Also add everything from the query dictionary in the response
-    #         **{k : v for k, v in query.items()}
-    #     }},
-    # ]
-    # # Finally: Query the database...
-    # args, kwargs = [], {'allowDiskUse' : True}
-    # cursor = db.articles.aggregate(pipeline, *args, **kwargs)
-    # response = list(cursor)
-
-    pipeline = [
-        {'$match' : match},
-        {'$sort' : {query.get('sort', DEFAULT_SORT) : order}},
-        # Write a temporary "output" collection
-        {'$out' : 'output'}
-    ]
-    # Finally: Query the database...
-    args, kwargs = [], {'allowDiskUse' : True}
-    # First query will perform, matching, sorting and writing to a temporary collection
-    cursor1 = db.articles.aggregate(pipeline, *args, **kwargs)
-    # Second query will simply read from the temporary collection
-    cursor2 = db.output.find(skip = offset, limit = limit)
+    key = query.get('sort', DEFAULT_SORT)
+    counting = query.get('count', True)
+    cursor = find(db, query)
 
     # Build the repsonse
     response = {k : v for k, v in query.items()}
-    response['total'] = db.output.count()
-    response['pages'] = ceil(response['total'] / limit)
-    response['results'] = list(cursor2)
+    results = list(cursor)
+    more = len(results) > limit
+    results = results[:limit]
+    if query.get('before'):
+        results.reverse()
+    response['results'] = results
+    response['size'] = len(results)
+
+    if not counting:
+        # "Has more" mode: neither the total number of articles nor the number of pages is known
+        response['total'], response['pages'], response['more'] = None, None, more
+    elif offset == 0 and response['size'] < limit and not query.get('after') and not query.get('before'):
+        # The first page already contains all matched articles, no need to count them
+        response['total'] = response['size']
+        response['pages'] = ceil(response['total'] / limit)
+    else:
+        response['total'] = count(db, _match(query))
+        response['pages'] = ceil(response['total'] / limit)
+
+    if query.get('seek') and results:
+        # Tokens for the neighbouring pages (if there are any)
+        if query.get('before'):
+            following, previous = True, more
+        else:
+            following, previous = more, bool(query.get('after'))
+        response['after'] = encode_cursor(results[-1], key) if following else None
+        response['before'] = encode_cursor(results[0], key) if previous else None
+
+    return response
+
+def search(db, query):
+    ''' Retrieves the articles matching a full-text search (query["search"]), ordered by relevance or by the sort key. '''
+
+    match = _match(query)
+    match['$and'].append({'$text' : {'$search' : query['search']}})
+    offset, limit = query.get('offset', 0), query.get('limit', DEFAULT_PAGE_LIMIT)
+
+    score = {'$meta' : 'textScore'}
+    if query.get('sort', 'relevance') == 'relevance':
+        sort = [('score', score), ('date', DESCENDING)]
+    else:
+        order = ASCENDING if 'reversed' in query else DESCENDING
+        sort = [(query['sort'], order), ('_id', order)]
+
+    # Results are ranked, i.e. there is no keyset to seek by; one additional article tells whether there is another page
+    # The plain text is needed for the snippets, the bodies are loaded on demand like in get()
+    projection = dict({field : True for field in PROJECTION + ('text',)}, score = score)
+    cursor = db.articles.find(match, projection = projection, sort = sort, skip = offset, limit = limit + 1)
+
+    response = {k : v for k, v in query.items()}
+    results = list(cursor)
+    response['more'] = len(results) > limit
+    response['results'] = results[:limit]
     response['size'] = len(response['results'])
+    response['terms'] = keywords(query['search'])
+
+    # The plain text is only needed for the snippets, it is never rendered as a whole
+    for article in response['results']:
+        article['snippet'] = snippet(decompress(article.pop('text', None)) or '', response['terms'])
 
-    # Delete the temporary collection
-    db.output.drop()
+    # Counting all matches of a frequent word is expensive, only do so if explicitly asked for
+    if query.get('count'):
+        response['total'] = count(db, match)
+        response['pages'] = ceil(response['total'] / limit)
+    else:
+        response['total'], response['pages'] = None, None
 
     return response
 
-def build_query(request, query = {}):
+def article(db, uid):
+    ''' Returns the body of an article with the fields of its breadcrumb (or None), see PROJECTION. '''
+
+    projection = ('title', 'link', 'author', 'language', 'date', 'content', 'read', 'marked', 'starred')
+    article = db.articles.find_one({'_id' : uid}, projection = projection)
+    # The body may be stored compressed (see STORAGE_COMPRESSION)
+    return unpack(article) if article else None
+
+def latest(db, scope, limit = OUTPUT_LIMIT):
+    ''' Returns the newest visible articles of a feed, a tag or the starred ones (scope) with the fields of the RSS outputs only. '''
+
+    # Uses the same indexes as the article lists, i.e. at most limit articles are read
+    projection = ('title', 'link', 'author', 'date', 'content', 'feed-name')
+    return db.articles.find(dict(scope, show = True), projection = projection, sort = [('date', DESCENDING), ('_id', DESCENDING)], limit = limit)
+
+def build_query(request, query = None):
     ''' Builds the query dictionary object to specify the database query. '''
 
+    # Never share a (mutable) default argument between requests
+    query = dict(query or {})
+
     # Only show articles with "show = True"
     query.update({'show' : True})
 
     # Pagination
-    page = request.args.get('page', 1)
     limit = int(request.args.get('limit', DEFAULT_PAGE_LIMIT))
-    offset = max(0, (int(page) - 1) * limit)
-    query.update({'limit' : limit, 'offset' : offset})
+    if PAGINATION == 'keyset' or 'after' in request.args or 'before' in request.args:
+        # Keyset pagination: the cost of a page doesn't depend on its depth
+        for key in ('after', 'before'):
+            if key in request.args:
+                query[key] = decode_cursor(request.args[key])
+                break
+        # Only count all matched articles if explicitly asked for
+        query.update({'limit' : limit, 'offset' : 0, 'seek' : True, 'count' : 'count' in request.args})
+    else:
+        page = request.args.get('page', 1)
+        offset = max(0, (int(page) - 1) * limit)
+        query.update({'limit' : limit, 'offset' : offset})
     # Sorting
     query.update({'sort' : request.args.get('sort', DEFAULT_SORT)})
     if 'reversed' in request.args:
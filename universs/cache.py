@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Process-local copies of small collections that are rendered on (almost) every page, i.e. feeds, tags, agents and filters.
+# Every write to one of these collections has to call bump() afterwards, which invalidates the copies in all processes.
+# The article counters of feeds and tags change with every flag, they are not part of the copies (see counters()).
+#
+# The same applies to the RSS outputs of feeds, tags and starred articles (see views.publish), which are cached serialized,
+# and to the entity tags of the article lists (see views.validate): every change of their articles has to call touch()
+# with the respective keys, i.e. "feed:<id>", "tag:<title>" or "starred" for the outputs and "list:feed:<id>",
+# "list:tag:<title>" or "list:articles" (all of them) for the lists. The outputs don't show the read and marked flags,
+# i.e. flagging an article must not change their entity tags (which clients poll).
+
+from hashlib import md5
+
+from pymongo import UpdateOne
+
+# Counters that are stored in every feed and tag document
+COUNTERS = ('total-articles', 'visible-articles', 'unread-articles', 'marked-articles', 'starred-articles')
+
+# {name : (version, documents)}
+_documents = {}
+
+# {key : (version, etag, body)}
+_outputs = {}
+
+def version(db):
+    ''' Returns the current version of the cached collections. '''
+
+    state = db.state.find_one({'_id' : 'version'})
+    return state['value'] if state else 0
+
+def bump(db):
+    ''' Invalidates the cached collections in all processes (call this after writing). '''
+    db.state.update_one({'_id' : 'version'}, {'$inc' : {'value' : 1}}, upsert = True)
+
+def load(db, name, current = None):
+    ''' Returns all documents of a collection, from the cache unless the version changed. '''
+
+    if current is None:
+        current = version(db)
+    if name in _documents and _documents[name][0] == current:
+        return _documents[name][1]
+
+    # Note that the version is read before the documents, i.e. a concurrent write will invalidate them again
+    documents = list(db[name].find(projection = {key : False for key in COUNTERS}))
+    _documents[name] = (current, documents)
+
+    return documents
+
+def counters(db):
+    ''' Returns the number of unread articles per feed (by ID) and per tag (by title), i.e. what the sidebars show. '''
+
+    # Two small projected queries, these are never cached
+    feeds = {feed['_id'] : feed.get('unread-articles', 0) for feed in db.feeds.find(projection = ('unread-articles',))}
+    tags = {tag['title'] : tag.get('unread-articles', 0) for tag in db.tags.find(projection = ('title', 'unread-articles'))}
+    return {'feeds' : feeds, 'tags' : tags}
+
+def revision(db, key):
+    ''' Returns the current version of an output. '''
+
+    state = db.state.find_one({'_id' : 'output:' + key})
+    return state['value'] if state else 0
+
+def touch(db, keys):
+    ''' Invalidates the cached outputs in all processes (call this after their articles changed). '''
+
+    operations = [UpdateOne({'_id' : 'output:' + key}, {'$inc' : {'value' : 1}}, upsert = True) for key in set(keys)]
+    if operations:
+        db.state.bulk_write(operations, ordered = False)
+
+def versions(db, keys):
+    ''' Returns the current version of the cached collections and of the given outputs (in this order), using one query. '''
+
+    ids = ['version'] + ['output:' + key for key in keys]
+    state = {document['_id'] : document['value'] for document in db.state.find({'_id' : {'$in' : ids}})}
+    return [state.get(i, 0) for i in ids]
+
+def output(db, key, render):
+    ''' Returns the entity tag and the body of an output, render() is only called if the version changed. '''
+
+    current = revision(db, key)
+    if key in _outputs and _outputs[key][0] == current:
+        return _outputs[key][1:]
+
+    body = render()
+    # Only the body counts, i.e. an output that is rendered again but didn't change keeps its entity tag (and the version
+    # starts over if the "state" collection is dropped)
+    etag = md5(body.encode('utf-8')).hexdigest()[:16]
+    _outputs[key] = (current, etag, body)
+
+    return etag, body
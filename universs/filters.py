@@ -3,6 +3,8 @@
 
 import html
 
+from calendar import timegm
+from email.utils import formatdate
 from pytz import timezone
 from universs import TIMEZONE, TIMEFORMAT
 
@@ -19,3 +21,8 @@ def _jinja2_filter_dt(date):
 @app.template_filter('unescape')
 def _jinja2_filter_unescape(value):
     return html.unescape(value)
+
+@app.template_filter('rfc822')
+def _jinja2_filter_rfc822(date):
+    # Dates are stored in UTC (naive or aware)
+    return formatdate(timegm(date.utctimetuple()), usegmt = True)
@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import re
 import xml.etree.ElementTree as etree
 
 from urllib.request import urlopen
 from urllib.error import URLError
+from urllib.parse import urlsplit, urlunsplit
 
-from pytz import timezone
+from markupsafe import Markup, escape
+from pytz import timezone, utc
 from datetime import datetime
 
 from universs import TIMEZONE
@@ -14,6 +17,9 @@ from universs import TIMEZONE
 def now():
     return timezone(TIMEZONE).localize(datetime.now())
 
+def utcnow():
+    return utc.localize(datetime.utcnow())
+
 def httpcheck(url = 'http://google.com', timeout = 3):
     try:
         urlopen(url)
@@ -21,19 +27,71 @@ def httpcheck(url = 'http://google.com', timeout = 3):
     except URLError:
         return False
 
-def read_opml(filename):
-    ''' Returns RSS feed title and URL from OPML export file.'''
+def iter_opml(source):
+    ''' Yields RSS feed title, URL and folder from an OPML export file (or file object), parsing it incrementally. '''
 
-    folder, feeds = '', []
-    tree = etree.parse(filename)
-    for element in tree.iter('outline'):
-        if 'title' in element.attrib:
+    folders = []
+    for event, element in etree.iterparse(source, events = ('start', 'end')):
+        if element.tag != 'outline':
+            continue
+        if event == 'start':
             if 'xmlUrl' in element.attrib:
-                # This is a feed...
-                title, url = element.attrib['title'], element.attrib['xmlUrl']
-                feeds.append((title, url, folder))
+                # This is a feed, "text" is mandatory in OPML 2.0 and "title" is optional...
+                title, url = element.get('title') or element.get('text') or element.attrib['xmlUrl'], element.attrib['xmlUrl']
+                yield title, url, folders[-1] if folders else ''
             else:
                 # This is a folder...
-                folder = element.attrib['title']
+                folders.append(element.get('title') or element.get('text') or '')
+        else:
+            if 'xmlUrl' not in element.attrib:
+                folders.pop()
+            # Don't keep the whole document in memory
+            element.clear()
+
+def read_opml(filename):
+    ''' Returns RSS feed title, URL and folder from OPML export file.'''
+    return list(iter_opml(filename))
+
+def canonical(url):
+    ''' Returns the URL in a form that is used to find duplicate feeds (scheme, case of the host, default ports, trailing slashes and fragments don't matter). '''
+
+    parts = urlsplit(url.strip())
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    host = (parts.hostname or '') + (':%d' % port if port and port not in (80, 443) else '')
+    return urlunsplit(('', host, parts.path.rstrip('/'), parts.query, ''))
+
+def keywords(search):
+    ''' Returns the phrases and words of a full-text search that should be highlighted (i.e. no negated ones). '''
+
+    phrases = re.findall('"([^"]+)"', search)
+    words = [word for word in re.sub('"[^"]*"', ' ', search).split() if not word.startswith('-')]
+    return [phrase.strip() for phrase in phrases if phrase.strip()] + words
+
+def snippet(text, terms, width = 240):
+    ''' Returns an excerpt of the text around the first match of any of the terms (as HTML), all matches are highlighted. '''
+
+    # The index stems words, i.e. "Häuser" also matches "Haus": match words by their prefix (without the usual inflection endings)
+    patterns = [re.escape(term) if ' ' in term else re.escape(term[:max(3, len(term) - 2)]) + r'\w*' for term in terms]
+    pattern = re.compile(r'\b(?:%s)' % '|'.join(sorted(patterns, key = len, reverse = True)), re.IGNORECASE) if patterns else None
+
+    match = pattern.search(text) if pattern else None
+    start = max(0, match.start() - width // 3) if match else 0
+    if start:
+        # Don't cut words in half
+        start = text.find(' ', start, match.start()) + 1 or start
+    end = start + width
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > start else end
+    excerpt = text[start:end]
+
+    html, position = Markup('…' if start else ''), 0
+    for m in (pattern.finditer(excerpt) if pattern else ()):
+        html += escape(excerpt[position:m.start()]) + Markup('<mark>%s</mark>') % m.group()
+        position = m.end()
+    html += escape(excerpt[position:]) + Markup('…' if end < len(text) else '')
 
-    return feeds
+    return html
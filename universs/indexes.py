@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# The database indexes are declared here, one for each query shape of the application, and reconciled by the "universs.indexes" task.
+# If you add a query, add (or reuse) an index and check its plan with benchmarks/explain.py.
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+from universs import SEARCH_LANGUAGE
+
+# Index options that distinguish two indexes on the same keys
+OPTIONS = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression', 'weights', 'default_language', 'language_override')
+
+# {collection : [(keys, options), ...]}, collections that are not listed here are left alone
+INDEXES = {
+    'articles' : [
+        # Article lists of a feed or a tag (base.get), sorted by date; also counters, deletes and updates by feed-id/tags
+        ([('feed-id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], {}),
+        ([('tags', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], {}),
+        # Article lists of all feeds ("show" is part of every such query, it bounds the counts as well)
+        ([('show', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], {}),
+        # New and modified articles since the last run of a metadata task (tasks.changed)
+        ([('downloaded', DESCENDING)], {}),
+        ([('modified', DESCENDING)], {'sparse' : True}),
+        # Full-text search (base.search), a title match counts ten times as much; the weights have to list every field.
+        # The articles' "language" field doesn't hold language names MongoDB knows of, i.e. it must not override the language.
+        ([('title', TEXT), ('text', TEXT)], {'name' : 'search', 'weights' : {'title' : 10, 'text' : 1}, 'default_language' : SEARCH_LANGUAGE, 'language_override' : 'search-language'}),
+    ],
+    'feeds' : [
+        # Feeds that are due for an update (scheduler.due), also all active feeds
+        ([('active', ASCENDING), ('next-due', ASCENDING)], {}),
+        ([('title', ASCENDING)], {}),
+        ([('tags', ASCENDING)], {}),
+    ],
+    'tags' : [
+        ([('title', ASCENDING)], {}),
+    ],
+}
+
+def _signature(keys, options):
+    ''' Returns a hashable representation of an index, i.e. its keys and relevant options. '''
+
+    fields = []
+    for key, direction in keys:
+        if direction != TEXT and key != '_ftsx':
+            fields.append((key, direction))
+        elif ('_fts', TEXT) not in fields:
+            # The server reports the fields of a text index as its weights and the keys as "_fts" and "_ftsx"
+            fields += [('_fts', TEXT), ('_ftsx', 1)]
+    values = {option : sorted(value.items()) if isinstance(value, dict) else value for option, value in options.items() if option in OPTIONS}
+
+    return tuple(fields), tuple(sorted((option, repr(value)) for option, value in values.items()))
+
+def reconcile(db, drop = True):
+    ''' Creates all declared indexes that are missing and drops all others (unless drop = False), returns their names. '''
+
+    created, dropped = [], []
+    for name, declared in INDEXES.items():
+        collection = db[name]
+        missing = {_signature(keys, options) : (keys, options) for keys, options in declared}
+
+        for index, info in collection.index_information().items():
+            if index == '_id_':
+                continue
+            signature = _signature(info['key'], info)
+            if signature in missing:
+                del missing[signature]
+            elif drop:
+                # Obsolete indexes are dropped first, a changed index (with the same name) can't be created otherwise
+                collection.drop_index(index)
+                dropped.append('%s.%s' % (name, index))
+
+        for keys, options in missing.values():
+            created.append('%s.%s' % (name, collection.create_index(keys, **options)))
+
+    return created, dropped
+
+def _stages(plan):
+    ''' Yields the names of all stages of the winning plan(s) in the output of explain(). '''
+
+    if isinstance(plan, dict):
+        for key, value in plan.items():
+            if key in ('rejectedPlans', 'allPlansExecution'):
+                continue
+            if key == 'stage':
+                yield value
+            else:
+                yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+def violations(plan):
+    ''' Returns the stages of a query plan (the output of explain()) that scan the collection or sort in memory. '''
+    return [stage for stage in _stages(plan) if stage in ('COLLSCAN', 'SORT')]
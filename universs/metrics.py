@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Lightweight instrumentation of the update pipeline and the web views, exposed in the Prometheus text format (see /metrics).
+# Every pipeline run (update, download, process, metadata) is recorded as one document in the capped "runs" collection.
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+from pymongo.errors import CollectionInvalid
+
+from universs import RUNS_SIZE
+from universs.helpers import utcnow
+
+# Upper bounds (in seconds) of the latency histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The record of the current pipeline run (of this process), tasks that are called from within another task add to its record
+_current = None
+
+# Request latencies of this process: {endpoint : [count per bucket (plus +Inf), sum]}
+_requests = {}
+
+@contextmanager
+def run(db, task):
+    ''' Records a pipeline run (stage durations, counters and fetched feeds) and stores it in the "runs" collection. '''
+
+    global _current
+
+    if _current is not None:
+        # Nested run, e.g. download() called by update()
+        yield _current
+        return
+
+    _current = {'task' : task, 'started' : utcnow(), 'stages' : {}, 'counters' : {}, 'feeds' : []}
+    start = perf_counter()
+    try:
+        yield _current
+    finally:
+        record, _current = _current, None
+        record['duration'] = perf_counter() - start
+        store(db, record)
+
+@contextmanager
+def stage(name):
+    ''' Adds the duration of the enclosed block to a stage of the current run. '''
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add(name, perf_counter() - start)
+
+def add(name, seconds):
+    ''' Adds a duration to a stage of the current run (if there is one). '''
+    if _current is not None:
+        _current['stages'][name] = _current['stages'].get(name, 0.0) + seconds
+
+def count(name, n = 1):
+    ''' Increments a counter of the current run (if there is one). '''
+    if _current is not None:
+        _current['counters'][name] = _current['counters'].get(name, 0) + n
+
+def feed(feedid, info):
+    ''' Records the fetch of a feed (see rss.stream), i.e. its latency, state, size and error. '''
+
+    if _current is None:
+        return
+    _current['feeds'].append({'feed-id' : feedid, 'latency' : info.get('latency', 0.0), 'state' : info['state'], 'bytes' : info['bytes'], 'error' : info.get('error')})
+    add('parse', info.get('parse', 0.0))
+    add('post-process', info.get('post-process', 0.0))
+    count('bytes', info['bytes'])
+    count('entries-skipped', info.get('skipped', 0))
+    count('feeds-stopped-early', info.get('stopped', False))
+    count('feeds-' + info['state'])
+
+def store(db, record):
+    ''' Stores the record of a run in the capped "runs" collection (which is created if necessary). '''
+
+    if 'runs' not in db.list_collection_names():
+        try:
+            db.create_collection('runs', capped = True, size = RUNS_SIZE)
+        except CollectionInvalid:
+            # Created concurrently by another process
+            pass
+    db.runs.insert_one(record)
+
+def observe(endpoint, seconds):
+    ''' Adds the latency of a request to the histogram of its endpoint. '''
+
+    histogram = _requests.setdefault(endpoint, [[0] * (len(BUCKETS) + 1), 0.0])
+    histogram[0][bisect_left(BUCKETS, seconds)] += 1
+    histogram[1] += seconds
+
+def _histogram(name, labels, counts, total):
+    ''' Returns the lines of a histogram in the Prometheus text format (counts per bucket, not cumulative). '''
+
+    lines, cumulative = [], 0
+    for bound, n in zip(BUCKETS + ('+Inf',), counts):
+        cumulative += n
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+    lines.append('%s_sum{%s} %f' % (name, labels, total))
+    lines.append('%s_count{%s} %d' % (name, labels, cumulative))
+    return lines
+
+def _escape(value):
+    ''' Escapes a label value. '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render(db, tasks = ('update', 'download', 'process', 'update_feed_metadata', 'update_tag_metadata')):
+    ''' Returns all metrics in the Prometheus text format: request latencies of this process and the latest run of every task. '''
+
+    lines = ['# HELP universs_request_duration_seconds Request latency per endpoint (of this process).', '# TYPE universs_request_duration_seconds histogram']
+    for endpoint, (counts, total) in sorted(_requests.items()):
+        lines += _histogram('universs_request_duration_seconds', 'endpoint="%s"' % _escape(endpoint), counts, total)
+
+    # The capped collection keeps the insertion order, i.e. the latest run comes first in reverse natural order
+    records = [record for record in (db.runs.find_one({'task' : task}, sort = [('$natural', -1)]) for task in tasks) if record]
+
+    lines += ['# HELP universs_run_timestamp_seconds Start of the latest run per task.', '# TYPE universs_run_timestamp_seconds gauge']
+    lines += ['universs_run_timestamp_seconds{task="%s"} %f' % (record['task'], record['started'].timestamp()) for record in records]
+    lines += ['# HELP universs_run_duration_seconds Duration of the latest run per task.', '# TYPE universs_run_duration_seconds gauge']
+    lines += ['universs_run_duration_seconds{task="%s"} %f' % (record['task'], record['duration']) for record in records]
+    lines += ['# HELP universs_stage_duration_seconds Duration of the stages of the latest run per task (parse and post-process are summed over all feeds).', '# TYPE universs_stage_duration_seconds gauge']
+    lines += ['universs_stage_duration_seconds{task="%s",stage="%s"} %f' % (record['task'], _escape(name), seconds) for record in records for name, seconds in sorted(record['stages'].items())]
+    lines += ['# HELP universs_run_total Counters of the latest run per task (bytes, articles, skipped entries and feeds per state).', '# TYPE universs_run_total gauge']
+    lines += ['universs_run_total{task="%s",counter="%s"} %d' % (record['task'], _escape(name), n) for record in records for name, n in sorted(record['counters'].items())]
+
+    lines += ['# HELP universs_fetch_duration_seconds Fetch latency per feed of the latest run per task.', '# TYPE universs_fetch_duration_seconds histogram']
+    for record in records:
+        if record['feeds']:
+            counts = [0] * (len(BUCKETS) + 1)
+            for f in record['feeds']:
+                counts[bisect_left(BUCKETS, f['latency'])] += 1
+            lines += _histogram('universs_fetch_duration_seconds', 'task="%s"' % record['task'], counts, sum(f['latency'] for f in record['feeds']))
+
+    return '\n'.join(lines) + '\n'
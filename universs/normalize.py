@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import re
+
+from html import unescape
+from functools import lru_cache
+from lxml.html import fromstring, tostring
+from lxml.html.clean import Cleaner as HTMLCleaner
+from lxml.etree import Error
+
+# Whitespace as defined by HTML5, the content of these elements is never collapsed
+SPACE = re.compile('[\x20\x09\x0a\x0c\x0d]+')
+PRESERVE = ('pre', 'textarea')
+
+# Comments and tags, only used for content that lxml can't parse at all
+MARKUP = re.compile('<!--.*?-->|<[^>]*>', re.DOTALL)
+
+@lru_cache(maxsize = 1)
+def cleaner():
+    ''' Returns the HTML cleaner (using lxml) that is applied to the content of all articles. '''
+
+    cleaner = HTMLCleaner()
+    attributes = ('scripts', 'javascript', 'comments', 'meta', 'forms', 'page_structure', 'annoying_tags', 'safe_attrs_only')
+    for attribute in attributes:
+        setattr(cleaner, attribute, True)
+    blacklist = ('align', 'valign', 'hspace', 'vspace', 'class')
+    cleaner.safe_attrs -= set(blacklist)
+
+    return cleaner
+
+def _collapse(text):
+    ''' Collapses whitespace in a text node, whitespace-only nodes that span lines are dropped entirely. '''
+
+    if not text:
+        return text
+    if not SPACE.sub('', text) and ('\n' in text or '\r' in text):
+        return None
+    return SPACE.sub(' ', text)
+
+def minify(element):
+    ''' Collapses whitespace in the tree (in place), equivalent to htmlmin with remove_empty_space = True. '''
+
+    preserved = set(node for parent in element.iter(*PRESERVE) for node in parent.iter())
+    for node in element.iter():
+        if not isinstance(node.tag, str):
+            # Comments and processing instructions
+            continue
+        if node not in preserved:
+            node.text = _collapse(node.text)
+        # The tail of a node belongs to its parent
+        if node is not element and node.getparent() not in preserved:
+            node.tail = _collapse(node.tail)
+
+    return element
+
+def normalize(content, sanitizer = None):
+    ''' Parses the content of an article once and returns the cleaned and minified HTML and its plain text. '''
+
+    sanitizer = sanitizer or cleaner()
+
+    try:
+        document = fromstring(content)
+        sanitizer(document)
+    except Error:
+        # e.g. empty documents (or only a comment), keep the content as it is, but never any markup in the text
+        text = SPACE.sub(' ', unescape(MARKUP.sub('', content)))
+        return (_collapse(content) or '').strip(), text.strip()
+
+    # The text is extracted from the cleaned tree, i.e. without scripts, styles and comments
+    text = document.text_content()
+    html = tostring(minify(document), encoding = 'unicode')
+
+    return html.strip(), text.strip()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Fast path for well-formed RSS 2.0 and Atom 1.0 feeds (using lxml's iterparse), which yields the same entries as feedparser
+# for all fields used by rss._post_process(). Everything else (RSS 1.0/RDF, malformed XML, unusual markup, xml:base) raises
+# Unsupported or an lxml error, and the caller falls back to feedparser.
+
+import re
+
+from io import BytesIO
+
+from feedparser.datetimes import _parse_date
+from lxml.etree import iterparse, tostring, Error
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+CONTENT = '{http://purl.org/rss/1.0/modules/content/}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+BASE = '{http://www.w3.org/XML/1998/namespace}base'
+LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+XHTML = '{http://www.w3.org/1999/xhtml}'
+
+# feedparser's way to find the e-mail address in an RSS author, e.g. "alice@example.com (Alice)"
+EMAIL = re.compile(r'(([a-zA-Z0-9\_\-\.\+]+)@((\[[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.)|(([a-zA-Z0-9\-]+\.)+))([a-zA-Z]{2,4}|[0-9]{1,3})(\]?))(\?subject=\S+)?')
+
+class Unsupported(Exception):
+    ''' Raised for documents (or parts of them) that the fast path doesn't handle like feedparser would. '''
+
+# Errors after which a document has to be parsed by feedparser instead
+ERRORS = (Unsupported, Error)
+
+def _date(element):
+    ''' Returns the date of an element as UTC struct_time (or None). '''
+    # feedparser's date handlers accept far more (broken) formats than the standard library, i.e. the dates are the same
+    return _parse_date(_text(element))
+
+def _text(element):
+    ''' Returns the text of a text construct (title, description, ...) or raises Unsupported if it contains markup. '''
+
+    if len(element):
+        # Unescaped (X)HTML
+        raise Unsupported(element.tag)
+    return (element.text or '').strip()
+
+def _title(element):
+    ''' Returns the title, titles with markup are sanitized by feedparser, i.e. left to it. '''
+
+    title = _text(element)
+    if '<' in title:
+        raise Unsupported('Markup in title')
+    return title
+
+def _author(value):
+    ''' Returns the author and the author details (name and e-mail address) of an RSS author, like feedparser. '''
+
+    detail, name, match = {}, value, EMAIL.search(value)
+    if match:
+        detail['email'] = match.group(0)
+        name = value.replace(detail['email'], '').replace('()', '').replace('<>', '').replace('&lt;&gt;', '').strip()
+        if name[:1] == '(':
+            name = name[1:]
+        if name[-1:] == ')':
+            name = name[:-1]
+        name = name.strip()
+    if name:
+        detail['name'] = name
+    return value, [detail]
+
+def _language(element):
+    ''' Returns the (inherited) xml:lang of an element or None. '''
+
+    while element is not None:
+        if LANG in element.attrib:
+            return element.attrib[LANG]
+        element = element.getparent()
+    return None
+
+def _rss(item):
+    ''' Returns the entry of an RSS 2.0 <item>. '''
+
+    entry, guid, permalink = {}, None, True
+    for child in item:
+        tag = child.tag
+        if tag == 'title':
+            entry['title'] = _title(child)
+        elif tag == 'link':
+            entry['link'] = _text(child)
+        elif tag == 'guid':
+            entry['id'] = guid = _text(child)
+            permalink = child.get('isPermaLink', 'true').lower() != 'false'
+        elif tag == 'author' or tag == DC + 'creator':
+            entry['author'], entry['authors'] = _author(_text(child))
+        elif tag == 'description':
+            entry['summary'] = _text(child)
+        elif tag == CONTENT + 'encoded':
+            entry['content'] = [{'value' : _text(child), 'language' : _language(child)}]
+        elif tag == 'pubDate':
+            entry['published_parsed'] = _date(child)
+        elif tag == DC + 'date':
+            entry['date_parsed'] = _date(child)
+
+    # The GUID is a permanent link unless stated otherwise
+    if 'link' not in entry and guid and permalink:
+        entry['link'] = guid
+    return entry
+
+def _atom(element):
+    ''' Returns the entry of an Atom <entry>. '''
+
+    entry = {}
+    for child in element:
+        tag = child.tag
+        if tag == ATOM + 'title':
+            if child.get('type') == 'xhtml':
+                raise Unsupported('XHTML title')
+            entry['title'] = _title(child)
+        elif tag == ATOM + 'link':
+            # The first alternate link is the link of the entry
+            if child.get('rel', 'alternate') == 'alternate' and 'link' not in entry:
+                entry['link'] = child.get('href', '').strip()
+        elif tag == ATOM + 'id':
+            entry['id'] = _text(child)
+        elif tag == ATOM + 'author' and 'author' not in entry:
+            detail = {key : child.findtext(ATOM + key, '').strip() for key in ('name', 'email')}
+            detail = {key : value for key, value in detail.items() if value}
+            # Same as feedparser: "name (email)", the name or the e-mail address
+            if len(detail) == 2:
+                entry['author'] = '%(name)s (%(email)s)' % detail
+            else:
+                entry['author'] = detail.get('name') or detail.get('email', '')
+            entry['authors'] = [detail]
+        elif tag == ATOM + 'summary' or tag == ATOM + 'content':
+            if child.get('src'):
+                raise Unsupported('Out-of-line content')
+            if child.get('type') == 'xhtml':
+                # The content is the inner XHTML of the <div> wrapper
+                div = child.find(XHTML + 'div')
+                if div is None or len(child) > 1:
+                    raise Unsupported('XHTML content')
+                value = (div.text or '') + ''.join(tostring(node, encoding = 'unicode') for node in div)
+                value = value.replace(' xmlns="http://www.w3.org/1999/xhtml"', '').strip()
+            else:
+                value = _text(child)
+            if tag == ATOM + 'summary':
+                entry['summary'] = value
+            else:
+                entry['content'] = [{'value' : value, 'language' : _language(child)}]
+        elif tag == ATOM + 'published':
+            entry['published_parsed'] = _date(child)
+        elif tag == ATOM + 'updated':
+            entry['date_parsed'] = _date(child)
+
+    # Entries without an alternate link are linked by their ID
+    if 'link' not in entry and entry.get('id'):
+        entry['link'] = entry['id']
+    return entry
+
+def parse(content):
+    ''' Parses an RSS 2.0 or Atom document and returns a {"feed" : {"title", "link"}, "entries" : generator} dictionary. '''
+
+    # Feeds are untrusted: never load external entities or DTDs (e.g. "file://" URLs), unresolved entities leave child
+    # nodes behind and fall back to feedparser (see _text)
+    events = iterparse(BytesIO(content), events = ('start', 'end'), resolve_entities = False, no_network = True, load_dtd = False, huge_tree = False)
+
+    # The root element decides about the format
+    _, root = next(events)
+    if BASE in root.attrib:
+        # feedparser resolves relative links (of entries and in their content) against xml:base, this parser doesn't
+        raise Unsupported('xml:base')
+    if root.tag == 'rss' and root.get('version', '').startswith('2.'):
+        kind, channel, item = _rss, 'channel', 'item'
+    elif root.tag == ATOM + 'feed':
+        kind, channel, item = _atom, ATOM + 'feed', ATOM + 'entry'
+    else:
+        raise Unsupported(root.tag)
+
+    # The feed's title and link are filled in while parsing, i.e. usually before the first entry
+    feed = {'title' : '', 'link' : ''}
+
+    def entries():
+        for event, element in events:
+            if event != 'end':
+                if BASE in element.attrib:
+                    raise Unsupported('xml:base')
+                continue
+            if element.tag == item:
+                yield kind(element)
+                # Free the parsed entries, the document is never kept in memory as a whole
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif element.getparent() is not None and element.getparent().tag == channel:
+                if element.tag in ('title', ATOM + 'title'):
+                    feed['title'] = _text(element)
+                elif element.tag == 'link':
+                    feed['link'] = _text(element)
+                elif element.tag == ATOM + 'link' and element.get('rel', 'alternate') == 'alternate' and not feed['link']:
+                    feed['link'] = element.get('href', '').strip()
+
+    return {'feed' : feed, 'entries' : entries()}
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import billiard
+
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pickle import PicklingError
+
+from universs import CPU_WORKERS, CPU_CHUNK
+
+# Pools of the current process (by number of workers), a forked child (e.g. a Celery worker) must not reuse its parent's pools
+_executors, _pid, _broken = {}, None, False
+
+def executor(workers = CPU_WORKERS):
+    ''' Returns the process pool for CPU-bound work or None if such work should run serially. '''
+
+    global _executors, _pid
+
+    if workers <= 1 or _broken:
+        return None
+    if _pid != os.getpid():
+        _executors, _pid = {}, os.getpid()
+    if workers not in _executors:
+        # The workers of Celery's prefork pool are daemonic and multiprocessing doesn't allow daemonic processes to have
+        # children, billiard (Celery's fork of multiprocessing) does
+        _executors[workers] = ProcessPoolExecutor(max_workers = workers, mp_context = billiard.get_context())
+
+    return _executors[workers]
+
+def run(function, items, *args, chunk = CPU_CHUNK, workers = CPU_WORKERS):
+    ''' Applies function(chunk, *args) to chunks of items (in parallel if possible) and returns the concatenated results. '''
+
+    global _broken
+
+    # Every work unit is a whole chunk, i.e. arguments and results are pickled once per chunk and not once per item
+    chunks = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+
+    pool = executor(workers)
+    if pool is not None and len(chunks) > 1:
+        try:
+            results = pool.map(function, chunks, *map(repeat, args))
+            return [item for result in results for item in result]
+        except (BrokenProcessPool, PicklingError) as e:
+            # e.g. a worker process was killed, fall back to serial processing from now on
+            print('Process pool disabled (%s), processing serially from now on.' % type(e).__name__)
+            _broken = True
+
+    return [item for c in chunks for item in function(c, *args)]
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import asyncio
 import feedparser
 import pytz
 
@@ -9,22 +10,71 @@ from urllib.request import urlopen, Request
 from urllib.error import HTTPError, URLError
 from http.client import IncompleteRead as IncompleteReadError
 from ssl import CertificateError
+from queue import Queue
+from threading import Thread
+from time import perf_counter
 
-from bs4 import BeautifulSoup
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientError
 from datetime import datetime
+from hashlib import md5
 from joblib import Parallel, delayed
 
-def _parse(content, verbose = False):
-    ''' Parses individual feed responses (using the feedparser package). '''
+from universs import FETCH_CONCURRENCY, FETCH_CONCURRENCY_PER_HOST, WATERMARK_SIZE
+from universs.parser import parse, ERRORS
 
-    feed = feedparser.parse(content)
-    url, title = getattr(feed['feed'], 'link', ''), getattr(feed['feed'], 'title', '')
+# Fields of a feed document that are used for conditional requests
+VALIDATORS = ('etag', 'last-modified', 'content-hash')
 
-    articles = []
+AGENT = 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/40.0.2214.85 Safari/537.36'
+
+def _key(entry):
+    ''' Returns the identity of a feed entry, i.e. its ID (GUID), link or title. '''
+    return entry.get('id') or entry.get('link') or entry.get('title', '')
+
+def _parse(content, verbose = False, watermark = None):
+    ''' Parses individual feed responses (using lxml or the feedparser package), skipping the entries below the watermark. '''
+
+    # Well-formed RSS 2.0 and Atom feeds are parsed incrementally (see universs.parser), everything else by feedparser
+    if isinstance(content, bytes):
+        try:
+            return _extract(parse(content), verbose, watermark)
+        except ERRORS:
+            pass
+    return _extract(feedparser.parse(content), verbose, watermark)
+
+def _extract(feed, verbose = False, watermark = None):
+    ''' Extracts the entries of a parsed feed (see _parse), skipping the entries below the watermark. '''
+
+    # The watermark of a feed holds the keys (see _key) of the entries seen before and the newest publishing date
+    known = set(watermark['ids']) if watermark else set()
+    newest = watermark['date'].replace(tzinfo = None) if watermark and watermark.get('date') else None
+
+    articles, keys, dates, skipped, stopped, ordered, previous = [], [], [], 0, False, True, None
     for i, entry in enumerate(feed['entries']):
+        key, parsed = _key(entry), entry.get('published_parsed') or entry.get('date_parsed')
+        date = datetime(*parsed[:6]) if parsed else None
+        # Only entries that are ordered by date (newest first) allow to stop early
+        ordered = ordered and date is not None and (previous is None or date <= previous)
+        previous = date
+        keys.append(key)
+        if date is not None:
+            dates.append(date)
+
+        if key in known:
+            skipped += 1
+            if ordered and newest is not None and date <= newest:
+                # A known entry that isn't newer than the watermark: all following entries are older, i.e. known as well
+                # Note that the fast parser doesn't even parse the remaining entries, i.e. they can't be counted then
+                if isinstance(feed['entries'], list):
+                    skipped += len(feed['entries']) - i - 1
+                stopped = True
+                break
+            continue
         if 'title' not in entry:
             # If we don't even get the article's title, skip it
             continue
+        # Note that the fast parser fills in the feed's title and link while iterating over the entries
+        url, title = feed['feed'].get('link', ''), feed['feed'].get('title', '')
         data = {'title' : entry['title'], 'feed-name' : title, 'feed-url' : url}
         data['id'] = '%s – %s' % (title, entry['title'])
         if verbose:
@@ -34,8 +84,10 @@ def _parse(content, verbose = False):
                 data[key] = entry[key]
         articles.append(data)
 
-    # Return a list of dictionaries, where every item corresponds to one entry listed in the feed
-    return articles
+    # Return a list of dictionaries, where every item corresponds to one new entry listed in the feed, the keys and the
+    # publishing dates of all entries up to the point where parsing stopped, the number of skipped entries and whether
+    # parsing stopped early
+    return articles, keys, dates, skipped, stopped
 
 def _post_process(articles, title = '', verbose = False):
     ''' Runs post-processing on the extracted information. '''
@@ -55,23 +107,17 @@ def _post_process(articles, title = '', verbose = False):
         if 'authors' in article and isinstance(article['authors'], (list, tuple)) and 'name' in article['authors'][0]:
             article['author'] = article['authors'][0]['name']
 
-        if 'published_parsed' in article:
-            try:
-                article['date'] = datetime(*article['published_parsed'][:6])
-            except TypeError:
-                article['date'] = datetime.utcnow()
-        elif 'date_parsed' in article:
-            article['date'] = datetime(*article['date_parsed'][:6])
-        else:
+        # Dates that couldn't be parsed are None (same as in _extract)
+        parsed = article.get('published_parsed') or article.get('date_parsed')
+        try:
+            article['date'] = datetime(*parsed[:6])
+        except TypeError:
             # If we can't find any information about the publishing date, let's take the time of crawling
             article['date'] = datetime.utcnow()
 
         if 'title' in article and 'subtitle' in article and article['title'] == article['subtitle']:
             article['subtitle'] = ''
 
-        # Try to extract get a text-only representation of the content
-        article['text'] = BeautifulSoup(article['content'], 'lxml').get_text()
-
         # Make sure that the following keys exist...
         for key in ('content', 'language', 'author', 'date'):
             if key not in article:
@@ -81,8 +127,8 @@ def _post_process(articles, title = '', verbose = False):
             if key in article:
                 del article[key]
 
-        # Remove leading and trailing whitespace
-        for key in ('content', 'text', 'title'):
+        # Remove leading and trailing whitespace (the text-only representation is extracted later, see normalize)
+        for key in ('content', 'title'):
             article[key] = article[key].strip()
 
         # Make article["date"] timezone aware
@@ -101,14 +147,34 @@ def _post_process(articles, title = '', verbose = False):
 def _process(response, title, verbose = False):
     ''' Parses the response and calls the post-processing routine on the extracted information. '''
 
-    articles = _parse(response, verbose = verbose)
+    articles, *_ = _parse(response, verbose = verbose)
     return _post_process(articles, title, verbose = verbose)
 
+def _process_timed(response, title, watermark = None):
+    ''' Same as _process(), but only processes entries above the watermark and returns some information about it. '''
+
+    start = perf_counter()
+    articles, keys, dates, skipped, stopped = _parse(response, watermark = watermark)
+    parsed = perf_counter()
+    articles = _post_process(articles, title)
+
+    # The new watermark: the keys of this document (newest first) and the ones seen before (up to WATERMARK_SIZE)
+    watermark, seen = watermark or {'ids' : [], 'date' : None}, set(keys)
+    ids = keys + [key for key in watermark['ids'] if key not in seen]
+    dates = [pytz.utc.localize(date) for date in dates]
+    # The newest date seen before is part of the feed's history, even if parsing stopped before reaching it
+    if watermark['date'] is not None:
+        dates.append(pytz.utc.localize(watermark['date'].replace(tzinfo = None)))
+    date = max(dates) if dates else None
+
+    # All publishing dates (not only the ones of new entries) estimate the feed's publishing interval, see scheduler.schedule()
+    info = {'parse' : parsed - start, 'post-process' : perf_counter() - parsed, 'skipped' : skipped, 'stopped' : stopped, 'dates' : dates, 'watermark' : {'ids' : ids[:WATERMARK_SIZE], 'date' : date}}
+    return articles, info
+
 def _pull(title, url, feedid, timeout = 3, *args, **kwargs):
     ''' Fetches, parses and processes individual RSS feed. '''
 
-    agent = 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/40.0.2214.85 Safari/537.36'
-    request = Request(url, data = None, headers = {'User-Agent': agent})
+    request = Request(url, data = None, headers = {'User-Agent': AGENT})
     try:
         response = urlopen(request, timeout = timeout)
     except (HTTPError, URLError, TimeoutError, ConnectionResetError, IncompleteReadError, CertificateError):
@@ -121,7 +187,11 @@ def _pull(title, url, feedid, timeout = 3, *args, **kwargs):
             return []
 
         # Parse the HTML/XHTML content using feedparser and post-process the entries
-        articles = _process(content, title)
+        try:
+            articles = _process(content, title)
+        except Exception:
+            # One broken document must not stop the other feeds
+            return []
 
         # Attach the feed identifier to all articles
         for article in articles:
@@ -131,22 +201,136 @@ def _pull(title, url, feedid, timeout = 3, *args, **kwargs):
     else:
         return []
 
-def pull(feeds, jobs = 30, timeout = 3, verbose = 5, backend = 'multiprocessing', *args, **kwargs):
+async def _fetch(session, title, url, feedid, validators = None, executor = None):
+    ''' Fetches an individual RSS feed asynchronously and processes it in an executor. '''
+
+    # Returns the feed identifier, the list of articles and some information about the response, i.e.
+    # the validators for the next conditional request, the number of bytes received and one of the following states:
+    # "modified", "not-modified" (HTTP 304), "unchanged" (same content hash as before) or "error".
+    # Modified feeds also return their new watermark (passed along with the validators), the number of skipped entries and
+    # whether parsing stopped early.
+    validators = validators or {}
+    info = {'state' : 'error', 'bytes' : 0, 'latency' : 0.0, 'error' : None, 'skipped' : 0, 'stopped' : False}
+    start = perf_counter()
+
+    # Conditional GET: the server will respond with 304 (and without a body) if the feed didn't change
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last-modified'):
+        headers['If-Modified-Since'] = validators['last-modified']
+
+    try:
+        async with session.get(url, headers = headers) as response:
+            if response.status == 304:
+                info.update({'state' : 'not-modified', 'latency' : perf_counter() - start})
+                return feedid, [], info
+            elif response.status != 200:
+                info.update({'error' : 'HTTP %d' % response.status, 'latency' : perf_counter() - start})
+                return feedid, [], info
+            # Note that gzip/deflate encoded responses are decompressed transparently
+            content = await response.read()
+            info.update({'etag' : response.headers.get('ETag', ''), 'last-modified' : response.headers.get('Last-Modified', '')})
+    except (ClientError, asyncio.TimeoutError, CertificateError, ValueError) as e:
+        info.update({'error' : type(e).__name__, 'latency' : perf_counter() - start})
+        return feedid, [], info
+
+    info['latency'] = perf_counter() - start
+
+    info['bytes'] = len(content)
+    info['content-hash'] = md5(content).hexdigest()
+
+    # Many servers don't support conditional requests, but still return the exact same document
+    if info['content-hash'] == validators.get('content-hash'):
+        info['state'] = 'unchanged'
+        return feedid, [], info
+
+    # Parsing is CPU-bound, don't block the event loop (and the other downloads) with it
+    loop = asyncio.get_running_loop()
+    try:
+        articles, timings = await loop.run_in_executor(executor, _process_timed, content, title, validators.get('watermark'))
+    except Exception as e:
+        # One broken document must not stop the other feeds
+        info['error'] = type(e).__name__
+        return feedid, [], info
+    info.update(timings)
+
+    # Attach the feed identifier to all articles
+    for article in articles:
+        article['feed-id'] = feedid
+
+    info['state'] = 'modified'
+    return feedid, articles, info
+
+async def _fetch_all(feeds, timeout = 3, concurrency = FETCH_CONCURRENCY, per_host = FETCH_CONCURRENCY_PER_HOST, executor = None):
+    ''' Fetches a list of RSS feeds concurrently and yields (feed identifier, articles, info) tuples as they complete. '''
+
+    # The connector limits the number of connections (globally and per host) and keeps them alive for reuse
+    connector = TCPConnector(limit = concurrency, limit_per_host = per_host, ttl_dns_cache = 300)
+    # Time spent waiting for a free connection does not count towards the timeout
+    timeout = ClientTimeout(total = None, sock_connect = timeout, sock_read = timeout)
+
+    async with ClientSession(connector = connector, timeout = timeout, headers = {'User-Agent' : AGENT}) as session:
+        # Feeds may carry a dictionary of validators (see VALIDATORS) as fourth element for conditional requests
+        futures = [_fetch(session, title, url, feedid, *validators[:1], executor = executor) for title, url, feedid, *validators in feeds]
+        for future in asyncio.as_completed(futures):
+            yield await future
+
+def stream(feeds, timeout = 3, concurrency = FETCH_CONCURRENCY, per_host = FETCH_CONCURRENCY_PER_HOST, executor = None, *args, **kwargs):
+    ''' Fetches, parses and processes a list of RSS feeds and yields (feed identifier, articles, info) tuples as they complete. '''
+
+    # The event loop runs in its own thread, so that the caller can consume the results while downloads are still running
+    results, done = Queue(), object()
+
+    async def produce():
+        async for result in _fetch_all(feeds, timeout, concurrency, per_host, executor):
+            results.put(result)
+
+    def run():
+        try:
+            asyncio.run(produce())
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(done)
+
+    thread = Thread(target = run, daemon = True)
+    thread.start()
+
+    while True:
+        result = results.get()
+        if result is done:
+            break
+        elif isinstance(result, Exception):
+            raise result
+        yield result
+
+    thread.join()
+
+def pull(feeds, jobs = 30, timeout = 3, verbose = 5, backend = 'threading', *args, **kwargs):
     ''' Fetches, parses and processes a list of RSS feeds in parallel. '''
 
-    # Input should be a list of (title, url) tuples or only one such tuple
+    # Input should be a list of (title, url, feedid) tuples or only one such tuple
     # Output will be a list of dictionaries, where every dictionary corresponds to one article
+    # The 'asyncio' backend (see stream()) only pays off with many more concurrent connections than threads, e.g. several
+    # hundred, with a few dozen both are on par (see benchmarks/fetch.py)
 
-    if isinstance(feeds, (tuple, list)) and isinstance(feeds[0], (tuple, list)):
+    if isinstance(feeds, (tuple, list)) and feeds and isinstance(feeds[0], (tuple, list)):
+        if backend == 'asyncio':
+            # All downloads share one event loop, jobs is the maximum number of concurrent connections
+            articles = [articles for feedid, articles, info in stream(feeds, timeout = timeout, concurrency = jobs, **kwargs)]
         # Note that jobs could be more than numbers of CPUs/threads due to the network IO
-        if jobs > 1:
+        elif jobs > 1:
             articles = Parallel(n_jobs = jobs, verbose = verbose, backend = backend)(delayed(_pull)(title, url, feedid, timeout = timeout) for title, url, feedid, *_ in feeds)
         else:
             articles = [_pull(title, url, feedid) for title, url, feedid, *_ in feeds]
 
         # Merge the results
         articles = [article for feed in articles for article in feed]
-    else:
+    elif feeds:
+        title, url, feedid, *_ = feeds
         articles = _pull(title, url, feedid, timeout = timeout)
+    else:
+        articles = []
 
     return articles
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from datetime import timedelta
+from statistics import median
+
+from pymongo import UpdateOne, ASCENDING
+
+from universs import SCHEDULE_MIN_INTERVAL, SCHEDULE_MAX_INTERVAL, SCHEDULE_BACKOFF, SCHEDULE_SMOOTHING, SCHEDULE_LIMIT
+
+def interval(dates, now):
+    ''' Estimates a feed's publishing interval (in seconds) from the publishing dates of its articles. '''
+
+    dates = sorted((min(date, now) for date in dates if date), reverse = True)
+    if len(dates) < 2:
+        return None
+
+    # Typical gap between two articles...
+    gaps = [(a - b).total_seconds() for a, b in zip(dates, dates[1:])]
+    # ...unless the feed has been quiet for even longer than that
+    return max(median(gaps), (now - dates[0]).total_seconds())
+
+def clamp(seconds):
+    return min(max(seconds, SCHEDULE_MIN_INTERVAL), SCHEDULE_MAX_INTERVAL)
+
+def schedule(db, results, now):
+    ''' Returns the database operations that set the next update for every fetched feed. '''
+
+    # Results are (feedid, articles, state, dates) tuples, where state is the fetcher's state of the feed and dates are the
+    # publishing dates of all entries listed (including the ones seen before, see rss._process_timed)
+    previous = {feed['_id'] : feed.get('update-interval') for feed in db.feeds.find({'_id' : {'$in' : [feedid for feedid, *_ in results]}}, projection = ('update-interval',))}
+
+    operations = []
+    for feedid, articles, state, dates in results:
+        before = previous.get(feedid) or SCHEDULE_MIN_INTERVAL
+        observed = interval(dates, now) if state == 'modified' else None
+
+        if observed is None and articles:
+            # New articles, but too few dates to tell the interval: keep it
+            seconds = before
+        elif observed is None:
+            # Nothing new (or the feed could not be fetched): back off
+            seconds = before * SCHEDULE_BACKOFF
+        else:
+            # Exponential smoothing, so a single burst of articles doesn't change the schedule entirely
+            seconds = SCHEDULE_SMOOTHING * observed + (1 - SCHEDULE_SMOOTHING) * before
+
+        seconds = clamp(seconds)
+        operations.append(UpdateOne({'_id' : feedid}, {'$set' : {'update-interval' : seconds, 'next-due' : now + timedelta(seconds = seconds)}}))
+
+    return operations
+
+def due(db, now, limit = SCHEDULE_LIMIT):
+    ''' Returns the active feeds that are due for an update, the most overdue ones first. '''
+
+    # Feeds that were never scheduled have no "next-due" field and will be fetched first
+    return db.feeds.find({'active' : True, '$or' : [{'next-due' : {'$lte' : now}}, {'next-due' : None}]}, sort = [('next-due', ASCENDING)], limit = limit)
@@ -1,4 +1,6 @@
 var active = null;
+// Requests for the bodies of the articles on this page (by ID), see load()
+var bodies = {};
 
 $(document).ready(function() {
 
@@ -42,14 +44,27 @@ $(document).ready(function() {
         }
     });
 
+    // Load the body as soon as an article starts to uncollapse
+    $("div#feed-articles .collapse").on('show.bs.collapse', function(e) {
+        var id = e.target.id;
+        load(id).done(function(data) {
+            var element = $("div#" + id);
+            if (element.is(":empty")) {
+                element.html(data.html);
+                buttons(id);
+            }
+        });
+        // Prefetch the neighbouring articles for J/K
+        load($(e.target).nextAll("div.collapse").first().attr("id"));
+        load($(e.target).prevAll("div.collapse").first().attr("id"));
+    });
+
     // Mark articles as read when uncollapse
-    $(".collapse").on('shown.bs.collapse', function(e) {
+    $("div#feed-articles .collapse").on('shown.bs.collapse', function(e) {
         // Get the article ID
         var id = $(e.target).data('bs.collapse').$trigger[0].hash.substring(1);
         // Set the new element as active element (globally)
         active = $("div#" + id);
-        // Uncomment the content
-        $(active).uncomment()
         // Mark the article as read
         read(id);
     });
@@ -61,6 +76,29 @@ $(document).ready(function() {
 
 });
 
+function load(id) {
+    // Requests the body of an article once, later calls share the same request
+    if (id && !(id in bodies)) {
+        bodies[id] = $.getJSON('/articles/' + encodeURIComponent(id));
+        bodies[id].fail(function() {
+            // Try again on the next uncollapse
+            delete bodies[id];
+        });
+    }
+    return bodies[id];
+}
+
+function buttons(id) {
+    // The flags may have changed since the body was requested, the title link is up to date
+    var element = $('a[href="#' + id + '"]');
+    var flags = [["read", "unread", "read-button", "unread-button"], ["marked", "unmarked", "mark-button", "unmark-button"], ["starred", "unstarred", "starred-button", "unstarred-button"]];
+    for (var i = 0; i < flags.length; i++) {
+        var set = $(element).hasClass("article-" + flags[i][0]);
+        $("li#" + id + "-" + flags[i][2]).toggle(!set);
+        $("li#" + id + "-" + flags[i][3]).toggle(set);
+    }
+}
+
 function showAll(id) {
     var url = window.location.origin + window.location.pathname;
     var parameters = window.location.search;
@@ -90,7 +128,7 @@ function showUnread(id) {
 function read(id) {
     var element = $('a[href="#' + id + '"]');
     if ($(element).hasClass("article-unread")) {
-        $.get('/flag/read/' + id);
+        $.get('/flag/read/' + id).done(updateCounters);
         $(element).removeClass("article-unread");
         $(element).addClass("article-read");
         $("li#" + id + "-unread-button").show();
@@ -102,7 +140,7 @@ function read(id) {
 function unread(id) {
     var element = $('a[href="#' + id + '"]');
     if ($(element).hasClass("article-read")) {
-        $.get('/flag/unread/' + id);
+        $.get('/flag/unread/' + id).done(updateCounters);
         $(element).removeClass("article-read");
         $(element).addClass("article-unread");
         $("li#" + id + "-unread-button").hide();
@@ -241,14 +279,33 @@ function toogleStar() {
 
 function markAllAsRead() {
     var articles = $('div#feed-articles div.collapse');
+    var ids = [];
     for (var i = 0; i < articles.length; i++) {
-        read(articles[i].id);
+        ids.push(articles[i].id);
+    }
+    // Flag all articles on this page with a single request
+    $.ajax({url: '/flag/read', type: 'POST', contentType: 'application/json', data: JSON.stringify({ids: ids})}).done(updateCounters);
+    for (var i = 0; i < ids.length; i++) {
+        var element = $('a[href="#' + ids[i] + '"]');
+        $(element).removeClass("article-unread");
+        $(element).addClass("article-read");
+        $("li#" + ids[i] + "-unread-button").show();
+        $("li#" + ids[i] + "-read-button").hide();
     }
+    console.log("Flagging " + ids.length + " articles as read");
+}
+
+function markFeedAsRead(selector) {
+    // Flag all articles of a feed or tag (e.g. {feed: "title"}), not only the ones on this page
+    selector["before"] = Date.now() / 1000;
+    $.ajax({url: '/flag/read', type: 'POST', contentType: 'application/json', data: JSON.stringify(selector)}).done(function() {
+        window.location.reload();
+    });
 }
 
 function openCurrentLink() {
     if (active) {
-        var url = $(active).find("ol li a").attr("href");
+        var url = $(active).data("link");
         window.open(url);
     }
 }
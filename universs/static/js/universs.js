@@ -0,0 +1,17 @@
+$(document).ready(function() {
+    updateCounters();
+});
+
+function updateCounters() {
+    // The number of unread articles per feed and tag is loaded separately, the pages themselves don't change when articles are read
+    if ($(".unread-badge").length == 0) {
+        return;
+    }
+    $.getJSON('/counters', function(data) {
+        $(".unread-badge").each(function() {
+            var n = $(this).data("feed") !== undefined ? data.feeds[$(this).data("feed")] : data.tags[$(this).data("tag")];
+            $(this).text(n || "");
+            $(this).toggle(n > 0);
+        });
+    });
+}
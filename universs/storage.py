@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Compressed storage of the article bodies (see STORAGE_COMPRESSION): the fields are stored as BSON binary with a
+# user-defined subtype per method, i.e. every value says how it has to be decompressed and plain strings (articles
+# written before or with compression turned off) are read as they are.
+
+import zlib
+
+from bson.binary import Binary
+
+try:
+    import zstandard
+except ImportError:
+    # Optional, bodies are compressed with zlib then
+    zstandard = None
+
+from universs import STORAGE_COMPRESSION, STORAGE_FIELDS
+
+# User-defined BSON binary subtypes (0x80 - 0xff)
+ZLIB, ZSTD = 0x80, 0x81
+
+# Fields that may be stored compressed, regardless of the current configuration
+FIELDS = ('content', 'text')
+
+def method(name = STORAGE_COMPRESSION):
+    ''' Returns the compression method that is actually used for a configured one (None, "zlib" or "zstd"). '''
+
+    if name == 'zstd' and zstandard is None:
+        return 'zlib'
+    return name
+
+def compress(value, name = STORAGE_COMPRESSION):
+    ''' Returns a string compressed with a method, or the string itself if it doesn't get any smaller. '''
+
+    name, raw = method(name), value.encode('utf-8')
+    if name == 'zstd':
+        packed = Binary(zstandard.ZstdCompressor(level = 3).compress(raw), ZSTD)
+    elif name == 'zlib':
+        packed = Binary(zlib.compress(raw, 6), ZLIB)
+    else:
+        return value
+    # Short bodies (e.g. a single sentence) are stored as they are
+    return packed if len(packed) < len(raw) else value
+
+def decompress(value):
+    ''' Returns the string of a (compressed) value. '''
+
+    if isinstance(value, Binary) and value.subtype == ZLIB:
+        return zlib.decompress(value).decode('utf-8')
+    if isinstance(value, Binary) and value.subtype == ZSTD:
+        if zstandard is None:
+            raise RuntimeError('Articles are stored with zstd, but the zstandard module is not installed')
+        return zstandard.ZstdDecompressor().decompress(value).decode('utf-8')
+    return value
+
+def pack(article, name = STORAGE_COMPRESSION, fields = STORAGE_FIELDS):
+    ''' Compresses the configured fields of an article (in place) and returns it. '''
+
+    for field in fields:
+        if isinstance(article.get(field), str):
+            article[field] = compress(article[field], name)
+    return article
+
+def unpack(article):
+    ''' Decompresses all compressed fields of an article (in place) and returns it, call this only where a body is used. '''
+
+    for field in FIELDS:
+        if field in article:
+            article[field] = decompress(article[field])
+    return article
@@ -4,44 +4,61 @@
 import numpy as np
 import pytz
 
-from universs import celery
+from universs import celery, cache, metrics, FETCH_CONCURRENCY
 from universs.base import init as dbinit
-from universs.rss import pull
+from universs.rss import stream, VALIDATORS
 from universs.helpers import httpcheck
-
-from pymongo.errors import DuplicateKeyError, BulkWriteError
-from pymongo import ASCENDING, DESCENDING
-
-from datetime import datetime
+from universs.scheduler import schedule, due
+from universs.pool import run, executor
+from universs.normalize import normalize, cleaner
+from universs.indexes import reconcile
+from universs.cache import COUNTERS
+from universs.storage import pack, compress, decompress, method, FIELDS
+from universs import STORAGE_COMPRESSION, STORAGE_FIELDS
+
+from pymongo.errors import BulkWriteError
+from pymongo import ASCENDING, UpdateOne, DeleteOne
+
+from datetime import datetime, timedelta
 from hashlib import md5
 from collections import Counter
-from lxml.html.clean import Cleaner as HTMLCleaner
-from lxml.etree import XMLSyntaxError, Error
-from htmlmin import minify
+from contextlib import contextmanager
+from uuid import uuid4 as uuid
 
 # This Celery schedule will be executed automatically...
 celery.conf.beat_schedule = {
     'auto-update': {
         'task': 'universs.update',
-        # Once every 10min
-        'schedule': 600.0,
-        'kwargs' : {'method' : 'roulette'}
-    },
-    'auto-update-full': {
-        'task': 'universs.update',
-        # Once every 24h
-        'schedule': 86400,
-        'kwargs' : {'method' : 'bulk'}
+        # Once every 5min, only feeds that are due will be updated (every feed at least once a day, see SCHEDULE_MAX_INTERVAL)
+        'schedule': 300.0,
+        'kwargs' : {'method' : 'schedule'}
     },
     'auto-update-tag-metadata': {
         'task': 'universs.update_tag_metadata',
-        # Once every 24h
-        'schedule': 86400
+        # Once every hour, only tags of feeds with new or modified articles
+        'schedule': 3600
+    },
+    'auto-update-tag-metadata-full': {
+        'task': 'universs.update_tag_metadata',
+        # Once every 24h, all tags: removes tags without feeds and corrects counters that drifted
+        'schedule': 86400,
+        'kwargs' : {'full' : True}
     },
     'auto-update-feed-metadata': {
         'task': 'universs.update_feed_metadata',
-        # Once every 24h
-        'schedule': 86400
+        # Once every hour, only feeds with new or modified articles
+        'schedule': 3600
+    },
+    'auto-update-feed-metadata-full': {
+        'task': 'universs.update_feed_metadata',
+        # Once every 24h, all feeds (see above)
+        'schedule': 86400,
+        'kwargs' : {'full' : True}
+    },
+    'auto-update-statistics': {
+        'task': 'universs.update_statistics',
+        # Once every hour
+        'schedule': 3600
     },
     'auto-update-indexes': {
         'task': 'universs.indexes',
@@ -51,9 +68,15 @@ celery.conf.beat_schedule = {
 }
 celery.conf.timezone = 'UTC'
 
+def entry(feed):
+    ''' Returns the (title, url, feedid, validators) tuple that is passed to the fetcher for a feed document. '''
+
+    validators = {key : feed.get(key, '') for key in VALIDATORS}
+    return (feed['title'], feed['url'], feed['_id'], validators)
+
 def bulk(db, *args, **kwargs):
     ''' Returns all active feeds in the database. '''
-    return [(feed['title'], feed['url'], feed['_id']) for feed in db.feeds.find({'active' : True})]
+    return [entry(feed) for feed in db.feeds.find({'active' : True})]
 
 def batch(db, *args, **kwargs):
     ''' Returns a random feed sample of active feeds in the database. '''
@@ -61,7 +84,7 @@ def batch(db, *args, **kwargs):
     # Choose a batch size (size of the sample)
     k = 50
     cursor = db.feeds.aggregate([{'$match' : {'active' : True}}, {'$sample' : {'size' : k}}])
-    return [(feed['title'], feed['url'], feed['_id']) for feed in cursor]
+    return [entry(feed) for feed in cursor]
 
 def roulette(db, *args, **kwargs):
     ''' Returns a random feed sample following the roulette wheel selection scheme. '''
@@ -76,13 +99,13 @@ def roulette(db, *args, **kwargs):
     # Choose a batch size (size of the sample)
     k = 50
     sample = np.random.choice(feeds, size = k, p = list(map(probabilities, feeds)))
-    return [(feed['title'], feed['url'], feed['_id']) for feed in sample]
+    return [entry(feed) for feed in sample]
 
 @celery.task(name = 'universs.update')
 def update(*args, **kwargs):
     ''' Pulls RSS articles from feeds and pushes new articles to database and updates metadata. '''
 
-    methods = ('bulk', 'batch', 'roulette')
+    methods = ('bulk', 'batch', 'roulette', 'schedule')
     if 'method' not in kwargs or kwargs['method'] not in methods:
         method = 'bulk'
     else:
@@ -96,182 +119,285 @@ def update(*args, **kwargs):
         print('No internet connectivity. Aborting.')
         return False
 
-    feeds = []
-    if 'title' in kwargs:
-        feed = db.feeds.find_one({'title' : kwargs['title']})
-        if feed:
-            feeds = [(feed['title'], feed['url'], feed['_id'])]
-    elif 'identifier' in kwargs:
-        feed = db.feeds.find_one({'_id' : kwargs['identifier']})
-        if feed:
-            feeds = [(feed['title'], feed['url'], feed['_id'])]
-    else:
-        if method == 'bulk':
-            # Update all active feeds
-            feeds = bulk(db, *args, **kwargs)
-        elif method == 'batch':
-            # Draw a random feed sample
-            feeds = batch(db, *args, **kwargs)
-        elif method == 'roulette':
-            # Roulette wheel selection
-            feeds = roulette(db, *args, **kwargs)
-
-    print('Update method: %s • %s: %d' % (method, 'Batch size' if method in ('batch', 'roulette') else 'Feeds', len(feeds)))
-
-    # This will download the respective feeds and put new articles in the "downloads" collection
-    download(feeds, *args, **kwargs)
-
-    print('Updating feed and tag metadata.')
-
-    # Update "last-update" timestamp in feed information
-    for title, url, feedid in feeds:
-        feed = db.feeds.find_one({'_id' : feedid})
-        feed['last-update'] = now
-        db.feeds.replace_one({'_id' : feedid}, feed)
-
-    # Find out how many new articles exist per feed
-    feed_counter = Counter(element['feed-id'] for element in db.downloads.find(projection = ('feed-id',)))
-    tag_counter = Counter()
-
-    # Now update the respective feed metadata (e.g. total number of articles, etc.)
-    for feedid in feed_counter:
-        feed = db.feeds.find_one({'_id' : feedid})
-        if feed:
-            for key in ('total-articles', 'visible-articles', 'unread-articles'):
-                feed[key] += feed_counter[feedid]
-            db.feeds.replace_one({'_id' : feedid}, feed)
-
-            # Update the tag counter
-            tag_counter += Counter(feed['tags'] * feed_counter[feedid])
-
-    # Update the respective tag metadata
-    for title in tag_counter:
-        tag = db.tags.find_one({'title' : title})
-        if tag:
-            for key in ('total-articles', 'visible-articles', 'unread-articles'):
-                tag[key] += tag_counter[title]
-            db.tags.replace_one({'_id' : tag['_id']}, tag)
+    # download() and process() add to the record of this run
+    with metrics.run(db, 'update'):
+        feeds = []
+        if 'title' in kwargs:
+            feed = db.feeds.find_one({'title' : kwargs['title']})
+            if feed:
+                feeds = [entry(feed)]
+        elif 'identifier' in kwargs:
+            feed = db.feeds.find_one({'_id' : kwargs['identifier']})
+            if feed:
+                feeds = [entry(feed)]
+        elif 'identifiers' in kwargs:
+            # e.g. all feeds of an OPML import
+            feeds = [entry(feed) for feed in db.feeds.find({'_id' : {'$in' : kwargs['identifiers']}})]
         else:
-            # This is a new tag
-            pass
+            if method == 'bulk':
+                # Update all active feeds
+                feeds = bulk(db, *args, **kwargs)
+            elif method == 'batch':
+                # Draw a random feed sample
+                feeds = batch(db, *args, **kwargs)
+            elif method == 'roulette':
+                # Roulette wheel selection
+                feeds = roulette(db, *args, **kwargs)
+            elif method == 'schedule':
+                # Feeds that are due according to their publishing interval
+                feeds = [entry(feed) for feed in due(db, now)]
+
+        print('Update method: %s • %s: %d' % (method, 'Batch size' if method in ('batch', 'roulette', 'schedule') else 'Feeds', len(feeds)))
+
+        # This will download the respective feeds and put new articles in the "downloads" collection
+        download(feeds, *args, **kwargs)
+
+        print('Updating feed and tag metadata.')
+        with metrics.stage('metadata'):
+            # Update "last-update" timestamp in feed information (one round trip, e.g. for all feeds of an OPML import)
+            db.feeds.update_many({'_id' : {'$in' : [feedid for title, url, feedid, *_ in feeds]}}, {'$set' : {'last-update' : now}})
+
+            # Find out how many new articles exist per feed
+            feed_counter = Counter(element['feed-id'] for element in db.downloads.find(projection = ('feed-id',)))
+            tag_counter = Counter()
+
+            # Now update the respective feed metadata (e.g. total number of articles, etc.)
+            for feedid in feed_counter:
+                feed = db.feeds.find_one({'_id' : feedid})
+                if feed:
+                    for key in ('total-articles', 'visible-articles', 'unread-articles'):
+                        feed[key] += feed_counter[feedid]
+                    db.feeds.replace_one({'_id' : feedid}, feed)
+
+                    # Update the tag counter
+                    tag_counter += Counter(feed['tags'] * feed_counter[feedid])
+
+            # Update the respective tag metadata
+            for title in tag_counter:
+                tag = db.tags.find_one({'title' : title})
+                if tag:
+                    for key in ('total-articles', 'visible-articles', 'unread-articles'):
+                        tag[key] += tag_counter[title]
+                    db.tags.replace_one({'_id' : tag['_id']}, tag)
+                else:
+                    # This is a new tag
+                    pass
+
+        # Finally, transfer the articles to the actual "articles" collection and wipe "downloads" collection
+        # Note that only the counters of feeds and tags have changed, they are not cached (see cache.counters)
+        N = process()
 
-    # Finally, transfer the articles to the actual "articles" collection and wipe "downloads" collection
-    N = process()
     return N
 
-@celery.task(name = 'universs.download')
-def download(feeds, *args, **kwargs):
-    ''' Pulls RSS articles from one feed and pushes new articles to database. '''
-
-    db = dbinit()
+def known(collection, uids, chunk = 10000):
+    ''' Returns the subset of article IDs that already exist in the collection. '''
 
-    # Use 120 threads, hide joblib output and set a 3s timeout for urlopen()
-    jobs, verbose, timeout = 120, 0, 3
+    found = set()
+    for i in range(0, len(uids), chunk):
+        cursor = collection.find({'_id' : {'$in' : uids[i:i + chunk]}}, projection = ('_id',))
+        found.update(document['_id'] for document in cursor)
+    return found
 
-    # Note: If you are using Celery for asynchronous tasks, you have to use the 'threading' backend instead of 'multiprocessing'
-    articles = pull(feeds, jobs, timeout = timeout, verbose = verbose, backend = 'threading')
-    queue = []
+def deduplicate(db, articles):
+    ''' Assigns IDs to downloaded articles and returns the new ones (and the number of duplicates). '''
 
+    # The ID of an article is the MD5 hash of "<feed-id> - <title>"
+    candidates = {}
     for article in articles:
-        # Now check if the article is already in db.articles (i.e. is an already processed, old article)
         uid = '%s - %s' % (article['feed-id'], article['title'])
-        uid = md5(uid.encode('utf-8')).hexdigest()
+        article['_id'] = md5(uid.encode('utf-8')).hexdigest()
+        # A feed may list the same article more than once
+        candidates.setdefault(article['_id'], article)
 
-        # Note that .find(...).limit(1).count() is for some reason faster than .find_one()
-        if db.articles.find({'_id' : uid}).limit(1).count():
-            continue
-        else:
-            # Assign the correct ID
-            article['_id'] = uid
+    # One query per collection (and chunk) instead of two queries per article
+    uids = list(candidates)
+    duplicates = known(db.articles, uids) | known(db.downloads, uids)
+    queue = [article for uid, article in candidates.items() if uid not in duplicates]
 
-            # If it's not in db.downloads, we'll add it to the queue
-            if not db.downloads.find({'_id' : uid}).limit(1).count():
-                queue.append(article)
+    return queue, len(articles) - len(queue)
 
-    if queue:
-        # Put all articles in a "downloads" collection. They will be processed later on...
-        if len(queue) > 1:
-            try:
-                db.downloads.insert_many(queue, ordered = False)
-            except BulkWriteError:
-                pass
-        else:
-            db.downloads.insert_one(queue[0])
+@celery.task(name = 'universs.download')
+def download(feeds, *args, **kwargs):
+    ''' Pulls RSS articles from one feed and pushes new articles to database. '''
 
-    # Print a status message
-    print('%d downloaded, %d queued articles.' % (len(articles), len(queue)))
+    db = dbinit()
+    now = pytz.utc.localize(datetime.utcnow())
 
-    return len(articles)
+    with metrics.run(db, 'download'):
+        # The watermarks (entries seen before) are kept apart from the feed documents, which are loaded far more often
+        # (e.g. by the views' cache), and passed along with the validators; one query for all feeds
+        feedids = [feedid for title, url, feedid, *_ in feeds]
+        seen = {document['_id'] : document['watermark'] for document in db.watermarks.find({'_id' : {'$in' : feedids}})}
+        feeds = [(title, url, feedid, dict(*conditional[:1], watermark = seen.get(feedid))) for title, url, feedid, *conditional in feeds]
 
-@celery.task(name = 'universs.process')
-def process(*args, **kwargs):
-    ''' Processes all downloaded articles listed in the database. '''
+        # Download all feeds concurrently on one event loop (see FETCH_CONCURRENCY) and set a 3s timeout per connection
+        jobs, timeout = FETCH_CONCURRENCY, 3
 
-    # This will process all documents in the "downloads" collection, process and push new articles to the "articles" collection and delete the document from "downloads".
+        # Note: If you want to use pull() with joblib instead, you have to use the 'threading' backend inside Celery, not 'multiprocessing'
+        articles, fetched, validators, watermarks, states, received, skipped, stopped = [], [], {}, {}, Counter(), 0, 0, 0
+        # Parsing and post-processing of the feeds will use a process pool if CPU_WORKERS > 1
+        # Note that the "fetch" stage is wall-clock time and includes parsing, the per-feed parse times are recorded separately
+        try:
+            with metrics.stage('fetch'):
+                for feedid, results, info in stream(feeds, timeout = timeout, concurrency = jobs, executor = executor()):
+                    articles.extend(results)
+                    fetched.append((feedid, results, info['state'], info.get('dates', [article['date'] for article in results])))
+                    states[info['state']] += 1
+                    received += info['bytes']
+                    skipped += info['skipped']
+                    stopped += info['stopped']
+                    metrics.feed(feedid, info)
+                    # Remember the validators for the next (conditional) request and the entries seen so far, but only once
+                    # the new articles have been queued (see below), otherwise they would never be fetched again
+                    if info['state'] in ('modified', 'unchanged'):
+                        validators[feedid] = {key : info[key] for key in VALIDATORS}
+                    if 'watermark' in info:
+                        watermarks[feedid] = info['watermark']
+        finally:
+            # Schedule the next update of every feed according to its publishing interval, even if the download failed:
+            # feeds that weren't fetched back off, otherwise due() would return the same batch again and again
+            done = set(feedid for feedid, *_ in fetched)
+            fetched += [(feedid, [], 'error', []) for feedid in feedids if feedid not in done]
+            with metrics.stage('schedule'):
+                operations = schedule(db, fetched, now)
+                if operations:
+                    db.feeds.bulk_write(operations, ordered = False)
+
+        print('%d feeds fetched: %d modified, %d not modified (304), %d unchanged, %d failed • %.1f kB received • %d known entries skipped, %d feeds parsed partially' % (len(feeds), states['modified'], states['not-modified'], states['unchanged'], states['error'], received / 1024.0, skipped, stopped))
+
+        # Drop all articles that have been processed or queued before
+        with metrics.stage('dedup'):
+            queue, duplicates = deduplicate(db, articles)
+        failed, lost = 0, set()
+
+        if queue:
+            # Put all articles in a "downloads" collection. They will be processed later on...
+            try:
+                with metrics.stage('insert'):
+                    db.downloads.insert_many(queue, ordered = False)
+            except BulkWriteError as e:
+                # Most likely a concurrent download queued the same articles in the meantime (duplicate key), any other
+                # error means that the article is lost unless its feed is fetched (and parsed) entirely again
+                failed = len(e.details['writeErrors'])
+                lost = set(queue[error['index']]['feed-id'] for error in e.details['writeErrors'] if error['code'] != 11000)
+
+        # Unchanged documents (and entries below the watermark) will be skipped by the next download
+        operations = [UpdateOne({'_id' : feedid}, {'$set' : values}) for feedid, values in validators.items() if feedid not in lost]
+        if operations:
+            db.feeds.bulk_write(operations, ordered = False)
+        operations = [UpdateOne({'_id' : feedid}, {'$set' : {'watermark' : watermark}}, upsert = True) for feedid, watermark in watermarks.items() if feedid not in lost]
+        if operations:
+            db.watermarks.bulk_write(operations, ordered = False)
+            # Feeds that still carry a watermark of their own (written by earlier versions) lose it, the next fetch is a full one
+            db.feeds.update_many({'_id' : {'$in' : feedids}, 'watermark' : {'$exists' : True}}, {'$unset' : {'watermark' : ''}})
+
+        metrics.count('articles-downloaded', len(articles))
+        metrics.count('articles-queued', len(queue) - failed)
+        metrics.count('articles-duplicate', duplicates)
+
+        # Print a status message
+        print('%d downloaded, %d new, %d duplicate, %d failed articles.' % (len(articles), len(queue) - failed, duplicates, failed))
 
-    db = dbinit()
-    now = pytz.utc.localize(datetime.utcnow())
+    return len(articles)
 
-    processed, pushed = 0, 0
-    for article in db.downloads.find():
+def prepare(article, tags, cleaner, now):
+    ''' Turns a downloaded article into an article that can be pushed to the "articles" collection. '''
 
-        # First of all, assert that the article's ID is correct, i.e. the MD5 hash of "<feed-id> - <title>"
-        uid = md5(('%s - %s' % (article['feed-id'], article['title'])).encode('utf-8')).hexdigest()
-        #assert article['_id'] == uid
+    # Insert some important flags
+    article['show'] = True
+    article['read'] = False
+    article['marked'] = False
+    article['starred'] = False
 
-        # Insert some important flags
-        article['show'] = True
-        article['read'] = False
-        article['marked'] = False
-        article['starred'] = False
+    # We do not accept publishing dates in the future
+    if article['date'] > now:
+        article['date'] = now
 
-        # We do not accept publishing dates in the future
-        if article['date'] > now:
-            article['date'] = now
+    # Store the time the article was downloaded
+    article['downloaded'] = now
 
-        # Store the time the article was downloaded
-        article['downloaded'] = now
+    # Get some feed specific information
+    article['tags'] = tags.get(article['feed-id'], [])
 
-        # Get some feed specific information from the database
-        feed = db.feeds.find_one({'title' : article['feed-name']})
-        article['tags'] = feed['tags']
+    # Clean and minify the HTML and extract a text-only representation, parsing the content only once (using lxml)
+    article['content'], article['text'] = normalize(article['content'], cleaner)
 
-        # Clean HTML (using lxml)
-        cleaner = HTMLCleaner()
-        attributes = ('scripts', 'javascript', 'comments', 'meta', 'forms', 'page_structure', 'annoying_tags', 'safe_attrs_only')
-        for attribute in attributes:
-            setattr(cleaner, attribute, True)
-        blacklist = ('align', 'valign', 'hspace', 'vspace', 'class')
-        cleaner.safe_attrs -= set(blacklist)
+    # Remove leading and trailing whitespace
+    article['title'] = article['title'].strip()
 
-        try:
-            article['content'] = cleaner.clean_html(article['content'])
-        except XMLSyntaxError:
-            pass
-        except Error:
-            pass
+    # Compress the bodies if configured (see STORAGE_COMPRESSION), this is CPU-bound as well
+    return pack(article)
 
-        # Minify HTML (using htmlmin)
-        article['content'] = minify(article['content'], remove_empty_space = True, reduce_boolean_attributes = True)
+@contextmanager
+def running(db, now):
+    ''' Records a running process() (and the "downloaded" time of its articles) in the "state" collection, see changed(). '''
 
-        # Remove leading and trailing whitespace
-        for key in ('content', 'text', 'title'):
-            article[key] = article[key].strip()
+    key = 'process:%s' % uuid()
+    db.state.insert_one({'_id' : key, 'started' : now})
+    try:
+        yield
+    finally:
+        db.state.delete_one({'_id' : key})
 
-        # Delete article from downloads collection
-        db.downloads.delete_one({'_id' : uid})
+def prepare_all(articles, tags, now):
+    ''' Prepares a chunk of articles, see prepare(). This is the work unit for the process pool. '''
+    return [prepare(article, tags, cleaner(), now) for article in articles]
 
-        try:
-            # Push new articles to the collection
-            db.articles.insert_one(article)
-        except DuplicateKeyError:
-            pass
-        else:
-            pushed += 1
+@celery.task(name = 'universs.process')
+def process(*args, chunk = 1000, **kwargs):
+    ''' Processes all downloaded articles listed in the database. '''
 
-        processed += 1
+    # This will process all documents in the "downloads" collection, process and push new articles to the "articles" collection and delete the documents from "downloads".
+    # Articles are pushed before they are deleted from "downloads", i.e. if the worker dies, the next run will simply pick up the remaining articles.
 
-    print('%d articles processed, %d new articles pushed to the database' % (processed, pushed))
+    db = dbinit()
+    now = pytz.utc.localize(datetime.utcnow())
+
+    # Feed specific information is looked up once per run, not once per article
+    tags = {feed['_id'] : feed['tags'] for feed in db.feeds.find(projection = ('tags',))}
+
+    with metrics.run(db, 'process'), running(db, now):
+        processed, pushed, failed, last = 0, 0, 0, None
+        while True:
+            # Walk through the downloads in chunks (ordered by ID)
+            criteria = {'_id' : {'$gt' : last}} if last is not None else {}
+            with metrics.stage('read'):
+                articles = list(db.downloads.find(criteria, sort = [('_id', ASCENDING)], limit = chunk))
+            if not articles:
+                break
+            last = articles[-1]['_id']
+
+            # Cleaning and minification are CPU-bound, this will use a process pool if CPU_WORKERS > 1
+            feedids = set(article['feed-id'] for article in articles)
+            with metrics.stage('clean'):
+                articles = run(prepare_all, articles, {feedid : tags.get(feedid, []) for feedid in feedids}, now)
+
+            with metrics.stage('insert'):
+                errors = set()
+                try:
+                    # Push new articles to the collection
+                    result = db.articles.insert_many(articles, ordered = False)
+                    pushed += len(result.inserted_ids)
+                except BulkWriteError as e:
+                    # Articles that already exist (duplicate key, e.g. from an interrupted run) are skipped, all others
+                    # (e.g. oversized documents) stay in "downloads" and are tried again by the next run
+                    pushed += e.details['nInserted']
+                    errors = set(articles[error['index']]['_id'] for error in e.details['writeErrors'] if error['code'] != 11000)
+                    failed += len(errors)
+
+                # Delete articles from downloads collection
+                db.downloads.delete_many({'_id' : {'$in' : [article['_id'] for article in articles if article['_id'] not in errors]}})
+
+            # The RSS outputs and article lists of these feeds and their tags have changed
+            keys = ['feed:%s' % feedid for feedid in feedids] + ['tag:%s' % title for feedid in feedids for title in tags.get(feedid, [])]
+            cache.touch(db, ['list:articles'] + keys + ['list:%s' % key for key in keys])
+
+            processed += len(articles)
+
+        metrics.count('articles-processed', processed)
+        metrics.count('articles-pushed', pushed)
+        metrics.count('articles-failed', failed)
+        print('%d articles processed, %d new articles pushed to the database, %d failed' % (processed, pushed, failed))
 
     return pushed
 
@@ -279,123 +405,251 @@ def process(*args, **kwargs):
 def update_article_metadata(*args, **kwargs):
     pass
 
+
+def aggregation(key, match = None):
+    ''' Returns the aggregation pipeline that counts total/visible/unread/marked/starred articles per value of key ("feed-id", "tags" or None for all articles). '''
+
+    visible = {'$eq' : ['$show', True]}
+    flagged = lambda flag, value: {'$cond' : [{'$and' : [visible, {'$eq' : ['$' + flag, value]}]}, 1, 0]}
+
+    pipeline = [{'$match' : match or {}}]
+    if key == 'tags':
+        # Every article is counted once for each of its tags
+        pipeline += [{'$project' : {'tags' : 1, 'show' : 1, 'read' : 1, 'marked' : 1, 'starred' : 1}}, {'$unwind' : '$tags'}]
+    pipeline.append({'$group' : {
+        '_id' : '$' + key if key else None,
+        # Total number of articles (including filtered/hidden)
+        'total-articles' : {'$sum' : 1},
+        # Number of articles that are visible
+        'visible-articles' : {'$sum' : {'$cond' : [visible, 1, 0]}},
+        # Number of unread, marked and starred articles
+        'unread-articles' : {'$sum' : flagged('read', False)},
+        'marked-articles' : {'$sum' : flagged('marked', True)},
+        'starred-articles' : {'$sum' : flagged('starred', True)},
+    }})
+
+    return pipeline
+
+def counters(db, key, match = None):
+    ''' Counts all articles per value of key (see aggregation()) in a single aggregation. '''
+    return {result.pop('_id') : result for result in db.articles.aggregate(aggregation(key, match), allowDiskUse = True)}
+
+def changed(db, task, now):
+    ''' Returns the IDs of all feeds with new or modified articles since the last run of the task (None if there was no run yet). '''
+
+    # Articles are stamped with the start of their process() run ("downloaded"), but inserted later on, i.e. the next run has
+    # to look back to the oldest running one; runs that died without cleaning up are ignored after a day (see full runs)
+    cutoff = now
+    for stamp in db.state.find({'_id' : {'$regex' : '^process:'}, 'started' : {'$gt' : now - timedelta(days = 1)}}, projection = ('started',)):
+        cutoff = min(cutoff, stamp['started'])
+
+    state = db.state.find_one({'_id' : task})
+    db.state.update_one({'_id' : task}, {'$set' : {'last-run' : cutoff}}, upsert = True)
+    if not state:
+        return None
+
+    since = state['last-run']
+    return db.articles.distinct('feed-id', {'$or' : [{'downloaded' : {'$gte' : since}}, {'modified' : {'$gte' : since}}]})
+
 @celery.task(name = 'universs.update_feed_metadata')
 def update_feed_metadata(*args, **kwargs):
-    ''' Performs a full update on a feed's metadata. '''
+    ''' Updates the feeds' metadata, i.e. the article counters (incrementally, unless full = True). '''
 
     db = dbinit()
+    now = pytz.utc.localize(datetime.utcnow())
 
     if 'title' in kwargs:
-        feed = db.feeds.find_one({'title' : kwargs['title']})
+        feedids = [feed['_id'] for feed in db.feeds.find({'title' : kwargs['title']}, projection = ('_id',))]
     elif 'identifier' in kwargs:
-        feed = db.feeds.find_one({'_id' : kwargs['identifier']})
+        feedids = [kwargs['identifier']]
     else:
-        for feed in db.feeds.find():
-            update_feed_metadata(identifier = feed['_id'])
-        return True
+        # Only feeds whose articles changed since the last run (or all of them)
+        feedids = None if kwargs.get('full', False) else changed(db, 'update_feed_metadata', now)
+        if feedids is None:
+            feedids = [feed['_id'] for feed in db.feeds.find(projection = ('_id',))]
 
-    if feed:
+    if not feedids:
+        return True
 
-        # Total number of articles (including filtered/hidden)
-        feed['total-articles'] = db.articles.find({'feed-id' : feed['_id']}).count()
-        # Number of articles that are visible
-        feed['visible-articles'] = db.articles.find({'feed-id' : feed['_id'], 'show' : True}).count()
-        # Number of unread articles
-        feed['unread-articles'] = db.articles.find({'feed-id' : feed['_id'], 'show' : True, 'read' : False}).count()
-        # Number of marked articles
-        feed['marked-articles'] = db.articles.find({'feed-id' : feed['_id'], 'show' : True, 'marked' : True}).count()
-        # Number of starred articles
-        feed['starred-articles'] = db.articles.find({'feed-id' : feed['_id'], 'show' : True, 'starred' : True}).count()
-
-        # If any filters are registered, apply them to fill up feed["articles"]
-        # if len(feed['filters']) > 0:
-        #     masks = []
-        #     for filterid in feed['filters']:
-        #         f = db.filters.find_one({'_id' : filterid})
-        #         if f and 'def filter(' in f['code']:
-        #             # Compile the filter code into _filter() function in locals
-        #             exec(f['code'].replace('def filter(', 'def _filter('))
-        #             # Run _filter() on respective articles
-        #             masks.append(list(map(locals()['_filter'], articles)))
-
-        #         # Transpose the boolean masks and compute row-wise logical and
-        #         mask = list(map(lambda x: all(x), zip(*masks)))
-        #         indices = [i for i, element in enumerate(mask) if element]
-        #         feed["articles"] = [articles[i]['_id'] for i in indices]
-        # else:
-        #     feed["articles"] = [article['_id'] for article in articles]
-
-        # Push changes to the database
-        db.feeds.replace_one({'_id' : feed['_id']}, feed)
+    with metrics.run(db, 'update_feed_metadata'), metrics.stage('metadata'):
+        # One aggregation for all counters of all feeds
+        results = counters(db, 'feed-id', {'feed-id' : {'$in' : feedids}})
+
+        # Feeds without any articles won't show up in the results
+        operations = [UpdateOne({'_id' : feedid}, {'$set' : results.get(feedid, {key : 0 for key in COUNTERS})}) for feedid in feedids]
+        db.feeds.bulk_write(operations, ordered = False)
+        metrics.count('feeds', len(feedids))
+
+    # If any filters are registered, apply them to fill up feed["articles"]
+    # if len(feed['filters']) > 0:
+    #     masks = []
+    #     for filterid in feed['filters']:
+    #         f = db.filters.find_one({'_id' : filterid})
+    #         if f and 'def filter(' in f['code']:
+    #             # Compile the filter code into _filter() function in locals
+    #             exec(f['code'].replace('def filter(', 'def _filter('))
+    #             # Run _filter() on respective articles
+    #             masks.append(list(map(locals()['_filter'], articles)))
+
+    #         # Transpose the boolean masks and compute row-wise logical and
+    #         mask = list(map(lambda x: all(x), zip(*masks)))
+    #         indices = [i for i, element in enumerate(mask) if element]
+    #         feed["articles"] = [articles[i]['_id'] for i in indices]
+    # else:
+    #     feed["articles"] = [article['_id'] for article in articles]
+
+    print('Metadata of %d feeds updated.' % len(feedids))
 
     return True
 
 @celery.task(name = 'universs.update_tag_metadata')
 def update_tag_metadata(*args, **kwargs):
-    ''' Performs a full update on a tag's metadata. '''
+    ''' Updates the tags' metadata, i.e. assigned feeds and article counters (incrementally, unless full = True). '''
 
     db = dbinit()
+    now = pytz.utc.localize(datetime.utcnow())
 
     if 'title' in kwargs:
-        tag = db.tags.find_one({'title' : kwargs['title']})
+        titles = [kwargs['title']]
     elif 'identifier' in kwargs:
         tag = db.tags.find_one({'_id' : kwargs['identifier']})
+        titles = [tag['title']] if tag else []
     else:
-        for tag in db.tags.find():
-            update_tag_metadata(identifier = tag['_id'])
+        # Only tags of feeds whose articles changed since the last run (or all of them)
+        feedids = None if kwargs.get('full', False) else changed(db, 'update_tag_metadata', now)
+        criteria = {} if feedids is None else {'_id' : {'$in' : feedids}}
+        titles = set(title for feed in db.feeds.find(criteria, projection = ('tags',)) for title in feed['tags'])
+        if feedids is None:
+            # Tags that aren't assigned to any feed any longer will be deleted below
+            titles |= set(tag['title'] for tag in db.tags.find(projection = ('title',)))
+        titles = list(titles)
+
+    if not titles:
         return True
 
-    if tag:
+    # Build the lists of feed IDs that have the respective tag assigned
+    feeds = {title : [] for title in titles}
+    for feed in db.feeds.find({'tags' : {'$in' : titles}}, projection = ('tags',)):
+        for title in feed['tags']:
+            if title in feeds:
+                feeds[title].append(feed['_id'])
+
+    with metrics.run(db, 'update_tag_metadata'), metrics.stage('metadata'):
+        # One aggregation for all counters of all tags
+        results = counters(db, 'tags', {'tags' : {'$in' : titles}})
+
+        operations = []
+        for title in titles:
+            if feeds[title]:
+                # This will also add new tags to the database
+                document = dict(results.get(title, {key : 0 for key in COUNTERS}), feeds = feeds[title])
+                operations.append(UpdateOne({'title' : title}, {'$set' : document}, upsert = True))
+            else:
+                # If there are no feeds assigned, then we can delete the tag
+                operations.append(DeleteOne({'title' : title}))
+        result = db.tags.bulk_write(operations, ordered = False)
+        metrics.count('tags', len(titles))
+    # The counters are not cached, but new and deleted tags are
+    if result.upserted_count or result.deleted_count:
+        cache.bump(db)
+
+    print('Metadata of %d tags updated.' % len(titles))
 
-        # Build a list of feed IDs that have the respective tag assigned
-        tag['feeds'] = [feed['_id'] for feed in db.feeds.find({'tags' : {'$in' : [tag['title']]}})]
-
-        # If there are no feeds assigned, then we can delete the tag
-        if len(tag['feeds']) == 0:
-            db.tags.delete_one({'_id' : tag['_id']})
-            return True
-
-        # Total number of articles (including filtered/hidden)
-        tag['total-articles'] = db.articles.find({'tags' : {'$in' : [tag['title']]}}).count()
-        # Number of articles that are visible
-        tag['visible-articles'] = db.articles.find({'show' : True, 'tags' : {'$in' : [tag['title']]}}).count()
-        # Number of unread articles
-        tag['unread-articles'] = db.articles.find({'show' : True, 'read' : False, 'tags' : {'$in' : [tag['title']]}}).count()
-        # Number of marked articles
-        tag['marked-articles'] = db.articles.find({'show' : True, 'marked' : True, 'tags' : {'$in' : [tag['title']]}}).count()
-        # Number of starred articles
-        tag['starred-articles'] = db.articles.find({'show' : True, 'starred' : True, 'tags' : {'$in' : [tag['title']]}}).count()
+    return True
 
-        # Push the changes to the database
-        db.tags.replace_one({'_id' : tag['_id']}, tag)
+@celery.task(name = 'universs.update_statistics')
+def update_statistics(*args, **kwargs):
+    ''' Computes the numbers shown on /statistics and /analytics and stores them as a timestamped snapshot. '''
 
-    else:
+    db = dbinit()
+    now = pytz.utc.localize(datetime.utcnow())
 
-        # This looks like a new tag...
-        if 'title' in kwargs:
-            tag = {'title' : kwargs['title']}
+    # One aggregation for all article counters and one for the feeds
+    articles = counters(db, None).get(None, {key : 0 for key in COUNTERS})
+    feeds = next(db.feeds.aggregate([{'$group' : {
+        '_id' : None,
+        'total' : {'$sum' : 1},
+        'inactive' : {'$sum' : {'$cond' : [{'$eq' : ['$active', False]}, 1, 0]}},
+        'last-update' : {'$max' : '$last-update'},
+    }}]), {'total' : 0, 'inactive' : 0, 'last-update' : None})
+
+    # Feeds without any articles, the distinct feed IDs are read from the "feed-id" index
+    feedids = set(db.articles.distinct('feed-id'))
+    empty = [feed for feed in db.feeds.find(projection = ('title', 'url')) if feed['_id'] not in feedids]
+
+    stats = {
+        'number-of-feeds' : feeds['total'],
+        'number-of-inactive-feeds' : feeds['inactive'],
+        'number-of-articles' : articles['total-articles'],
+        'number-of-tags' : db.tags.estimated_document_count(),
+        'number-of-agents' : db.agents.estimated_document_count(),
+        'number-of-filters' : db.filters.estimated_document_count(),
+        'number-of-unfiltered-articles' : articles['visible-articles'],
+        'number-of-filtered-articles' : articles['total-articles'] - articles['visible-articles'],
+        'number-of-unread-articles' : articles['unread-articles'],
+        'number-of-marked-articles' : articles['marked-articles'],
+        'number-of-starred-articles' : articles['starred-articles'],
+        'database-size' : db.command('dbstats')['dataSize'] / 1024.0**2,
+        'last-update' : feeds['last-update'],
+    }
+    analytics = {'feeds-without-articles' : empty}
+    db.state.replace_one({'_id' : 'statistics'}, {'_id' : 'statistics', 'created' : now, 'statistics' : stats, 'analytics' : analytics}, upsert = True)
 
-            # Let's check if there are any feeds that use this tag
-            tag['feeds'] = [feed['_id'] for feed in db.feeds.find({'tags' : {'$in' : [tag['title']]}})]
-            if len(tag['feeds']) > 0:
-                # Add the new tag to the database and update its metadata
-                db.tags.insert_one(tag)
-                return update_tag_metadata(title = tag['title'])
+    print('Statistics updated.')
 
     return True
 
 @celery.task(name = 'universs.indexes')
 def indexes(*args, **kwargs):
-    ''' Ensures proper database indexes. '''
+    ''' Ensures proper database indexes, i.e. the ones declared in universs.indexes (obsolete ones are dropped unless drop = False). '''
 
     db = dbinit()
+    created, dropped = reconcile(db, drop = kwargs.get('drop', True))
 
-    # Articles
-    db.articles.create_index([('_id', ASCENDING), ('id', ASCENDING), ('show', ASCENDING), ('tags', ASCENDING), ('feed-name', ASCENDING), ('read', ASCENDING), ('marked', ASCENDING), ('starred', ASCENDING), ('date', DESCENDING)])
-    # Feeds
-    db.feeds.create_index([('_id', ASCENDING), ('title', ASCENDING), ('tags', ASCENDING)])
-    # Tags
-    db.tags.create_index([('_id', ASCENDING), ('feeds', ASCENDING), ('title', ASCENDING)])
+    print('%d indexes created, %d indexes dropped.' % (len(created), len(dropped)))
+
+    return True
+
+@celery.task(name = 'universs.storage')
+def storage(*args, chunk = 1000, **kwargs):
+    ''' Converts the bodies of existing articles to the configured storage format (compressed or not, see STORAGE_COMPRESSION). '''
+
+    db = dbinit()
+    name = method(STORAGE_COMPRESSION)
+
+    with metrics.run(db, 'storage'):
+        converted = 0
+        for field in FIELDS:
+            compressing = name is not None and field in STORAGE_FIELDS
+            # Plain strings have to be compressed, compressed values (binary) decompressed; the other ones are left as they are
+            criteria = {field : {'$type' : 'string' if compressing else 'binData'}}
+
+            last = None
+            while True:
+                # Walk through the articles in chunks (ordered by ID), i.e. the task can be interrupted at any time
+                match = dict(criteria, _id = {'$gt' : last}) if last is not None else criteria
+                with metrics.stage('read'):
+                    articles = list(db.articles.find(match, projection = (field,), sort = [('_id', ASCENDING)], limit = chunk))
+                if not articles:
+                    break
+                last = articles[-1]['_id']
+
+                with metrics.stage('convert'):
+                    articles = run(convert_all, articles, field, name if compressing else None)
+                with metrics.stage('update'):
+                    # Only articles that still have the old value are changed, i.e. concurrent writes are not overwritten
+                    db.articles.bulk_write([UpdateOne({'_id' : article['_id'], field : value}, {'$set' : {field : article[field]}}) for article, value in articles], ordered = False)
+
+                converted += len(articles)
+                metrics.count('%s-converted' % field, len(articles))
+
+        print('%d article fields converted (storage: %s).' % (converted, name or 'plain'))
+
+    return converted
+
+def convert_all(articles, field, name):
+    ''' Converts a field of a chunk of articles to a storage format, returns (article, old value) pairs, see storage(). '''
+    return [(dict(article, **{field : compress(decompress(article[field]), name)}), article[field]) for article in articles]
 
 def backup(*args, **kwargs):
     ''' Writes a backup of the database to disk. '''
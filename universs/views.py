@@ -1,34 +1,117 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
-from flask import g, request, redirect, url_for, render_template, jsonify
+import gzip
+
+from flask import g, request, redirect, url_for, render_template, jsonify, abort, make_response, Response
 from uuid import uuid4 as uuid
-from time import time
+from hashlib import md5
+from time import time, perf_counter
+from datetime import datetime
+from pytz import utc
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import OperationFailure
+from xml.etree.ElementTree import ParseError
+from xml.sax.saxutils import quoteattr
+
+try:
+    import brotli
+except ImportError:
+    # Optional, responses are compressed with gzip then
+    brotli = None
 
 # Import the Flask app
-from universs import app
+from universs import app, CONDITIONAL_TIMEOUT, COMPRESS_MIN_SIZE
 
-from universs.helpers import now
-from universs.base import get, build_query
+from universs.helpers import now, utcnow, iter_opml
+from universs.storage import unpack
+from universs.base import get, search, article, latest, build_query, create_feeds
 from universs.base import init as dbinit
+from universs.rss import VALIDATORS
+from universs import cache, metrics
 
 @app.before_request
 def init():
 
-    g.db = db = dbinit()
-    g.feeds = list(db.feeds.find())
-    g.tags = list(db.tags.find())
-    g.agents = list(db.agents.find())
-    g.filters = list(db.filters.find())
+    g.start = perf_counter()
+    g.db = dbinit()
+
+@app.after_request
+def timing(response):
+
+    # Server-side request latency, e.g. shown in the browser's developer tools and on /metrics
+    if 'start' in g:
+        elapsed = perf_counter() - g.start
+        response.headers['Server-Timing'] = 'app;dur=%.1f' % (elapsed * 1000)
+        metrics.observe(request.endpoint or 'unknown', elapsed)
+    return response
+
+# Content types that are compressed (if large enough, see COMPRESS_MIN_SIZE)
+COMPRESSIBLE = ('text/html', 'text/plain', 'application/json', 'application/rss+xml')
+
+@app.after_request
+def compress(response):
+    ''' Compresses large responses with brotli or gzip, if the client accepts it. '''
+
+    # Static files and streamed responses (e.g. the OPML export) are sent as they are
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200 or response.mimetype not in COMPRESSIBLE:
+        return response
+    if 'Content-Encoding' in response.headers or response.content_length < COMPRESS_MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if brotli and request.accept_encodings['br']:
+        response.set_data(brotli.compress(response.get_data(), quality = 5))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(response.get_data(), 6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def validate(keys):
+    ''' Returns the entity tag of an article list, which depends on the versions of its articles (see cache.touch). '''
+
+    # The sidebar lists all feeds and tags, i.e. every page also depends on the version of the cached collections
+    version, *outputs = cache.versions(g.db, keys)
+    # documents() doesn't have to look up the version again
+    g.version = version
+    key = repr((version, outputs, request.full_path, int(time() // CONDITIONAL_TIMEOUT)))
+    return md5(key.encode('utf-8')).hexdigest()
+
+def conditional(etag, render):
+    ''' Returns 304 (Not Modified) if the client's copy of the page is current, the rendered page otherwise. '''
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status = 304)
+    else:
+        response = make_response(render())
+    # Weak, the same page may be sent compressed or not; clients have to revalidate it on every use
+    response.set_etag(etag, weak = True)
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/metrics')
+def prometheus():
+
+    # Request latencies are recorded per process, i.e. every web worker reports its own histograms
+    return metrics.render(g.db), 200, {'Content-Type' : 'text/plain; version=0.0.4; charset=utf-8'}
+
+def documents(name):
+    ''' Returns all feeds, tags, agents or filters (from the process-local cache), only call this if the page renders them. '''
+
+    # The version is looked up at most once per request
+    if 'version' not in g:
+        g.version = cache.version(g.db)
+    return cache.load(g.db, name, g.version)
 
 @app.route('/tasks/<string:action>')
 @app.route('/tasks/<string:action>/title/<string:title>')
 @app.route('/tasks/<string:action>/id/<string:identifier>')
 def tasks(action, title = None, identifier = None):
 
-    from universs.tasks import update, download, process, update_feed_metadata, update_tag_metadata
+    from universs.tasks import update, download, process, update_feed_metadata, update_tag_metadata, update_statistics, storage
 
-    if action in ('update', 'download', 'process', 'update_feed_metadata', 'update_tag_metadata'):
+    if action in ('update', 'download', 'process', 'update_feed_metadata', 'update_tag_metadata', 'update_statistics', 'storage'):
         if action in locals():
             f = locals()[action]
             if title:
@@ -58,6 +141,7 @@ def feeds(action = None, title = None):
 
             # Push new feed to the database
             db.feeds.insert_one(feed)
+            cache.bump(db)
 
             from universs.tasks import update
             # Pull, process and push articles from new feed
@@ -66,14 +150,16 @@ def feeds(action = None, title = None):
         return redirect(url_for('feeds'))
     else:
         if action == 'new':
-            return render_template('./feeds/new.html', feeds = g.feeds, agents = g.agents, filters = g.filters, now = now())
+            return render_template('./feeds/new.html', feeds = documents('feeds'), agents = documents('agents'), filters = documents('filters'), now = now())
         elif action == 'delete':
             if title:
                 feed = db.feeds.find_one({'title' : title})
                 # Delete all articles that belong to the feed
                 db.articles.delete_many({'feed-id' : feed['_id']})
-                # Delete the feed
+                # Delete the feed (and the entries it listed before)
                 db.feeds.delete_one({'_id' : feed['_id']})
+                db.watermarks.delete_one({'_id' : feed['_id']})
+                cache.bump(db)
             return redirect(url_for('feeds'))
         elif action == 'deactivate':
             if title:
@@ -81,6 +167,7 @@ def feeds(action = None, title = None):
                 if feed and feed['active']:
                     feed['active'] = False
                     db.feeds.replace_one({'_id' : feed['_id']}, feed)
+                    cache.bump(db)
             return redirect(url_for('feeds'))
         elif action == 'activate':
             if title:
@@ -88,20 +175,113 @@ def feeds(action = None, title = None):
                 if feed and not feed['active']:
                     feed['active'] = True
                     db.feeds.replace_one({'_id' : feed['_id']}, feed)
+                    cache.bump(db)
             return redirect(url_for('feeds'))
         else:
             if title:
                 feed = db.feeds.find_one({'title' : title})
                 if feed:
-                    query = build_query(request, {'feed-id' : feed['_id']})
-                    response = get(db, query)
-                else:
-                    response = {}
-                return render_template('./feeds/feeds.html', name = title, feeds = g.feeds, feed = feed, response = response, now = now())
+                    def render():
+                        response = get(db, build_query(request, {'feed-id' : feed['_id']}))
+                        return render_template('./feeds/feeds.html', name = title, feeds = documents('feeds'), feed = feed, response = response, now = now())
+                    return conditional(validate(['list:feed:%s' % feed['_id']]), render)
+                return render_template('./feeds/feeds.html', name = title, feeds = documents('feeds'), feed = feed, response = {}, now = now())
             else:
-                query = build_query(request)
-                response = get(db, query)
-                return render_template('./feeds/feeds.html', name = title, feeds = g.feeds, feed = {'title' : 'Alle Artikel'}, response = response, special = True, now = now())
+                def render():
+                    response = get(db, build_query(request))
+                    return render_template('./feeds/feeds.html', name = title, feeds = documents('feeds'), feed = {'title' : 'Alle Artikel'}, response = response, special = True, now = now())
+                return conditional(validate(['list:articles']), render)
+
+def publish(key, title, link, scope):
+    ''' Returns the RSS output of the newest articles of a scope, rendered only if they changed (see cache.output). '''
+
+    def render():
+        articles = [unpack(article) for article in latest(g.db, scope)]
+        return render_template('output/rss.xml', title = title, link = link, description = 'universs: %s' % title, articles = articles)
+
+    etag, body = cache.output(g.db, key, render)
+    response = Response(body, mimetype = 'application/rss+xml')
+    # Weak, the same output may be sent compressed or not
+    response.set_etag(etag, weak = True)
+    # Clients may keep the output, but have to revalidate it, i.e. polling costs a 304 (and one lookup) as long as nothing changed
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Titles may contain slashes (and end with ".xml"), i.e. the outputs live apart from the pages of feeds and tags
+@app.route('/output/feeds/<path:name>')
+def feed_output(name):
+
+    title = name[:-len('.xml')] if name.endswith('.xml') else None
+    feed = g.db.feeds.find_one({'title' : title}, projection = ('_id',)) if title else None
+    if not feed:
+        abort(404)
+    return publish('feed:%s' % feed['_id'], title, url_for('feeds', action = 'show', title = title, _external = True), {'feed-id' : feed['_id']})
+
+@app.route('/output/tags/<path:name>')
+def tag_output(name):
+
+    title = name[:-len('.xml')] if name.endswith('.xml') else None
+    if not title or not g.db.tags.find_one({'title' : title}, projection = ('_id',)):
+        abort(404)
+    return publish('tag:%s' % title, title, url_for('tags', title = title, _external = True), {'tags' : title})
+
+@app.route('/starred.xml')
+def starred_output():
+    return publish('starred', 'Favoriten', url_for('feeds', _external = True, starred = ''), {'starred' : True})
+
+@app.route('/opml/import', methods = ['POST'])
+def opml_import():
+
+    db = g.db
+
+    try:
+        # The file is parsed while it is read, and all new feeds are inserted at once
+        feedids = create_feeds(db, iter_opml(request.files['opml'].stream))
+    except (KeyError, ParseError):
+        return jsonify({'message' : 'Invalid OPML file', 'status' : 400, 'mimetype' : 'application/json'}), 400
+
+    if feedids:
+        cache.bump(db)
+
+        from universs.tasks import update, update_tag_metadata
+        # Create the new tags and pull, process and push the articles of all new feeds in one task
+        for title in db.feeds.distinct('tags', {'_id' : {'$in' : feedids}}):
+            update_tag_metadata.delay(title = title)
+        update.delay(identifiers = feedids)
+
+    return redirect(url_for('feeds'))
+
+@app.route('/opml/export')
+def opml_export():
+
+    # The tags of a feed are its folders, i.e. a feed is listed once per tag (and once without a folder if it has none)
+    # and the import merges them again (see base.create_feeds)
+    cursor = g.db.feeds.aggregate([
+        {'$unwind' : {'path' : '$tags', 'preserveNullAndEmptyArrays' : True}},
+        {'$project' : {'title' : True, 'url' : True, 'folder' : {'$ifNull' : ['$tags', '']}}},
+        {'$sort' : {'folder' : ASCENDING, 'title' : ASCENDING}},
+    ], allowDiskUse = True)
+
+    def generate(chunk = 1000):
+        # The document is streamed while reading the feeds, in chunks of lines
+        lines, folder = ['<?xml version="1.0" encoding="UTF-8"?>', '<opml version="2.0">', '<head><title>universs</title></head>', '<body>'], ''
+        for feed in cursor:
+            if feed['folder'] != folder:
+                if folder:
+                    lines.append('</outline>')
+                folder = feed['folder']
+                if folder:
+                    lines.append('<outline text=%s title=%s>' % (quoteattr(folder), quoteattr(folder)))
+            lines.append('<outline type="rss" text=%s title=%s xmlUrl=%s/>' % (quoteattr(feed['title']), quoteattr(feed['title']), quoteattr(feed['url'])))
+            if len(lines) >= chunk:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if folder:
+            lines.append('</outline>')
+        lines += ['</body>', '</opml>']
+        yield '\n'.join(lines) + '\n'
+
+    return Response(generate(), mimetype = 'text/x-opml', headers = {'Content-Disposition' : 'attachment; filename=universs.opml'})
 
 @app.route('/tags')
 @app.route('/tags/<string:title>')
@@ -112,13 +292,77 @@ def tags(title = None):
     if title:
         tag = db.tags.find_one({'title' : title})
         if tag:
-            query = build_query(request, {'tags' : tag['title']})
-            response = get(db, query)
-        else:
-            response = {}
-        return render_template('tags/tags.html', name = title, tag = tag, tags = g.tags, response = response, now = now())
+            def render():
+                response = get(db, build_query(request, {'tags' : tag['title']}))
+                return render_template('tags/tags.html', name = title, tag = tag, tags = documents('tags'), response = response, now = now())
+            return conditional(validate(['list:tag:%s' % tag['title']]), render)
+        return render_template('tags/tags.html', name = title, tag = tag, tags = documents('tags'), response = {}, now = now())
     else:
-        return render_template('tags/tags.html', name = title, tags = g.tags, response = {}, now = now())
+        return render_template('tags/tags.html', name = title, tags = documents('tags'), response = {}, now = now())
+
+def search_query(db):
+    ''' Builds the query dictionary object for a full-text search, i.e. /search?q=...[&feed=...][&tag=...][&sort=date]. '''
+
+    scope = {}
+    if request.args.get('feed'):
+        feed = db.feeds.find_one({'title' : request.args['feed']}, projection = ('_id',))
+        scope['feed-id'] = feed['_id'] if feed else None
+    if request.args.get('tag'):
+        scope['tags'] = request.args['tag']
+
+    query = build_query(request, scope)
+    # Search all (visible) articles unless asked for read/unread ones
+    if query.pop('default', False):
+        query['all'] = True
+    # Results are ranked by relevance, i.e. they are always paginated by page number
+    for key in ('seek', 'after', 'before'):
+        query.pop(key, None)
+    page = max(1, int(request.args.get('page', 1)))
+    query.update({'search' : request.args.get('q', '').strip(), 'sort' : request.args.get('sort', 'relevance'), 'offset' : (page - 1) * query['limit'], 'page' : page, 'count' : 'count' in request.args})
+
+    return query
+
+@app.route('/search')
+def search_page():
+
+    db = g.db
+
+    query = search_query(db)
+    try:
+        response = search(db, query) if query['search'] else {}
+    except OperationFailure:
+        # e.g. the text index hasn't been built yet (see the "universs.indexes" task)
+        response = {'error' : True}
+
+    return render_template('search.html', name = query['search'], feeds = documents('feeds'), tags = documents('tags'), response = response, special = True, now = now())
+
+@app.route('/api/search')
+def search_api():
+
+    db = g.db
+
+    query = search_query(db)
+    if not query['search']:
+        return jsonify({'message' : 'No search terms specified', 'status' : 400, 'mimetype' : 'application/json'}), 400
+    try:
+        response = search(db, query)
+    except OperationFailure as e:
+        return jsonify({'message' : str(e), 'status' : 503, 'mimetype' : 'application/json'}), 503
+
+    fields = ('_id', 'title', 'link', 'feed-id', 'feed-name', 'date', 'read', 'marked', 'starred', 'score', 'snippet')
+    results = [{key : article.get(key) for key in fields} for article in response['results']]
+    return jsonify({'message' : 'Ok', 'status' : 200, 'mimetype' : 'application/json', 'results' : results, 'page' : query['page'], 'more' : response['more'], 'total' : response['total']})
+
+@app.route('/articles/<string:uid>')
+def article_body(uid):
+
+    document = article(g.db, uid)
+    if not document:
+        return jsonify({'message' : 'Article not found', 'status' : 404, 'mimetype' : 'application/json'}), 404
+
+    # Rendered on the server (breadcrumb and body), the same markup the article lists used to inline
+    html = render_template('includes/article.html', article = document)
+    return jsonify({'message' : 'Ok', 'status' : 200, 'mimetype' : 'application/json', '_id' : uid, 'html' : html})
 
 @app.route('/settings')
 @app.route('/settings/feed/<string:name>', methods = ['GET', 'POST'])
@@ -144,9 +388,17 @@ def settings(name = None):
         if feed['title'] != f['title']:
             db.articles.update_many({'feed-id' : feed['_id']}, {'$set' : {'feed-name' : f['title']}})
 
+        # Validators for conditional requests (and the entries seen) are only valid for the old URL
+        if feed['url'] != f['url']:
+            for key in VALIDATORS:
+                feed.pop(key, None)
+            db.watermarks.delete_one({'_id' : feed['_id']})
+
         # Update the feed information in the database
         feed.update(f)
         db.feeds.replace_one({'_id' : request.form['id']}, feed)
+        cache.bump(db)
+        cache.touch(db, ['feed:%s' % feed['_id'], 'list:feed:%s' % feed['_id']])
 
         # This will create a list of all tags that were removed in the update procedure
         deleted_tags = list(tags_before - set(f['tags']))
@@ -172,8 +424,8 @@ def settings(name = None):
     else:
         if name:
             feed = db.feeds.find_one({'title' : name})
-            return render_template('feeds/settings.html', name = name, feed = feed, feeds = g.feeds, agents = g.agents, filters = g.filters)
-        return render_template('./settings.html', feeds = g.feeds)
+            return render_template('feeds/settings.html', name = name, feed = feed, feeds = documents('feeds'), agents = documents('agents'), filters = documents('filters'))
+        return render_template('./settings.html', feeds = documents('feeds'))
 
 @app.route('/filters')
 @app.route('/filters/<string:action>', methods = ['GET', 'POST'])
@@ -194,10 +446,11 @@ def filters(action = None, uid = None):
                 else:
                     f['blocks'].append([value])
             db.filters.insert_one(f)
+            cache.bump(db)
             return redirect(url_for('filters'))
         else:
             uid = int(time())
-            return render_template('./filters/filter-new.html', agents = g.agents, feeds = g.feeds, uid = uid)
+            return render_template('./filters/filter-new.html', agents = documents('agents'), feeds = documents('feeds'), uid = uid)
     elif action == 'edit':
         if request.method == 'POST':
             f = {'id' : request.form['id'], 'name' : request.form['name'], 'description' : request.form['description']}
@@ -205,14 +458,16 @@ def filters(action = None, uid = None):
             x = db.filters.find_one({'_id' : request.form['id']})
             x.update(f)
             db.filters.replace_one({'_id' : request.form['id']}, x)
+            cache.bump(db)
         else:
             f = db.filters.find_one({'_id' : uid})
-            return render_template('./filters/filter-edit.html', f = f, feeds = g.feeds)
+            return render_template('./filters/filter-edit.html', f = f, feeds = documents('feeds'))
         return redirect(url_for('filters'))
     elif action == 'delete':
         db.filters.delete_one({'_id' : uid})
+        cache.bump(db)
         return redirect(url_for('filters'))
-    return render_template('./filters/filters.html', filters = g.filters, feeds = g.feeds)
+    return render_template('./filters/filters.html', filters = documents('filters'), feeds = documents('feeds'))
 
 @app.route('/agents')
 @app.route('/agents/<string:action>', methods = ['GET', 'POST'])
@@ -225,96 +480,164 @@ def agents(action = None, uid = None, name = None):
         if request.method == 'POST':
             a = {'_id' : request.form['id'], 'name' : request.form['name'], 'description' : request.form['description'], 'language' : request.form['language'], 'code' : request.form['code']}
             db.agents.insert_one(a)
+            cache.bump(db)
             return redirect(url_for('agents'))
         else:
             uid = int(time())
-            return render_template('./agents/agent-new.html', uid = uid, feeds = g.feeds)
+            return render_template('./agents/agent-new.html', uid = uid, feeds = documents('feeds'))
     elif action == 'edit':
         if request.method == 'POST':
             a = {'name' : request.form['name'], 'description' : request.form['description'], 'language' : request.form['language'], 'code' : request.form['code'], }
             x = db.agents.find_one({'_id' : request.form['id']})
             x.update(a)
             db.agents.replace_one({'_id' : request.form['id']}, x)
+            cache.bump(db)
         else:
             a = db.agents.find_one({'_id' : uid})
-            return render_template('./agents/agent-edit.html', a = a, feeds = g.feeds)
+            return render_template('./agents/agent-edit.html', a = a, feeds = documents('feeds'))
         return redirect(url_for('agents'))
     elif action == 'delete':
         db.agents.delete_one({'_id' : uid})
+        cache.bump(db)
         return redirect(url_for('agents'))
     else:
-        agents = g.get('agents', [])
-        return render_template('./agents/agents.html', feeds = g.feeds, agents = agents)
+        return render_template('./agents/agents.html', feeds = documents('feeds'), agents = documents('agents'))
+
+# Flags that can be set on articles: (field, value, counter)
+FLAGS = {
+    'read' : ('read', True, 'unread-articles'), 'unread' : ('read', False, 'unread-articles'),
+    'mark' : ('marked', True, 'marked-articles'), 'marked' : ('marked', True, 'marked-articles'),
+    'unmark' : ('marked', False, 'marked-articles'), 'unmarked' : ('marked', False, 'marked-articles'),
+    'star' : ('starred', True, 'starred-articles'), 'starred' : ('starred', True, 'starred-articles'),
+    'unstar' : ('starred', False, 'starred-articles'), 'unstarred' : ('starred', False, 'starred-articles'),
+}
+
+def delta(key, value):
+    ''' Returns the change of the respective counter if a flag is set to value for one article. '''
+
+    # Note that the counter for "read" is the number of *unread* articles
+    if key == 'read':
+        return -1 if value else 1
+    return 1 if value else -1
 
 @app.route('/flag/<string:f>/<string:uid>')
 def flag(f, uid):
 
     db = g.db
 
-    article = db.articles.find_one({'_id' : uid})
+    if f not in FLAGS:
+        return jsonify({'message' : 'No action required', 'status' : 200, 'mimetype' : 'application/json'})
+    key, value, counter = FLAGS[f]
+
+    # Only change the article if the flag isn't set already, i.e. two concurrent requests can't both apply the change
+    article = db.articles.find_one_and_update({'_id' : uid, key : not value}, {'$set' : {key : value, 'modified' : utcnow()}}, projection = ('feed-id', 'tags', 'show'))
     if article:
-        if f == 'read' and not article['read']:
-            article['read'] = True
-            # Update feed and tag metadata
-            db.feeds.update_one({'_id' : article['feed-id']}, {'$inc' : {'unread-articles' : -1}})
-            db.tags.update_many({'title' : {'$in' : article['tags']}}, {'$inc' : {'unread-articles' : -1}})
-        elif f == 'unread' and article['read']:
-            article['read'] = False
+        # Only the lists that contain the article have changed, the counters are not cached (see cache.counters); the RSS
+        # outputs don't show any flags, but the output of the starred articles depends on them
+        cache.touch(db, ['list:articles', 'list:feed:%s' % article['feed-id']] + ['list:tag:%s' % title for title in article['tags']] + (['starred'] if key == 'starred' else []))
+        if article['show']:
             # Update feed and tag metadata
-            db.feeds.update_one({'_id' : article['feed-id']}, {'$inc' : {'unread-articles' : 1}})
-            db.tags.update_many({'title' : {'$in' : article['tags']}}, {'$inc' : {'unread-articles' : 1}})
-        elif f in ('mark', 'marked') and not article['marked']:
-            article['marked'] = True
-        elif f in ('unmark', 'unmarked') and article['marked']:
-            article['marked'] = False
-        elif f in ('star', 'starred') and not article['starred']:
-            article['starred'] = True
-        elif f in ('unstar', 'unstarred') and article['starred']:
-            article['starred'] = False
-        else:
-            return jsonify({'message' : 'No action required', 'status' : 200, 'mimetype' : 'application/json'})
-
-        # Push changes to database
-        db.articles.replace_one({'_id' : article['_id']}, article)
+            db.feeds.update_one({'_id' : article['feed-id']}, {'$inc' : {counter : delta(key, value)}})
+            db.tags.update_many({'title' : {'$in' : article['tags']}}, {'$inc' : {counter : delta(key, value)}})
         return jsonify({'message' : 'Ok', 'status' : 200, 'mimetype' : 'application/json'})
+    elif db.articles.find_one({'_id' : uid}, projection = ('_id',)):
+        return jsonify({'message' : 'No action required', 'status' : 200, 'mimetype' : 'application/json'})
     else:
         return jsonify({'message' : 'Article not found', 'status' : 200, 'mimetype' : 'application/json'})
 
-@app.route('/analytics')
-def analytics():
+@app.route('/flag/<string:f>', methods = ['POST'])
+def flag_many(f):
+    ''' Flags a list of articles (ids) or all articles of a feed/tag (optionally published before a UNIX timestamp) as read/unread. '''
 
     db = g.db
+    data = request.get_json(silent = True) or request.form
+
+    if f not in ('read', 'unread'):
+        return jsonify({'message' : 'Not implemented', 'status' : 501, 'mimetype' : 'application/json'}), 501
+    key, value, counter = FLAGS[f]
+    if not isinstance(data, dict):
+        return jsonify({'message' : 'Invalid request', 'status' : 400, 'mimetype' : 'application/json'}), 400
+
+    # Values become part of the query, i.e. anything but a string (e.g. {"$exists" : true}) would be an operator
+    if any(data.get(name) and not isinstance(data[name], str) for name in ('feed', 'tag')):
+        return jsonify({'message' : 'Invalid feed or tag', 'status' : 400, 'mimetype' : 'application/json'}), 400
+
+    criteria = {key : not value}
+    if 'ids' in data:
+        criteria['_id'] = {'$in' : data['ids'] if isinstance(data['ids'], list) else request.form.getlist('ids')}
+    if data.get('feed'):
+        feed = db.feeds.find_one({'title' : data['feed']}, projection = ('_id',))
+        criteria['feed-id'] = feed['_id'] if feed else None
+    if data.get('tag'):
+        criteria['tags'] = data['tag']
+    if data.get('before'):
+        try:
+            criteria['date'] = {'$lt' : datetime.fromtimestamp(float(data['before']), utc)}
+        except (TypeError, ValueError, OverflowError, OSError):
+            return jsonify({'message' : 'Invalid timestamp', 'status' : 400, 'mimetype' : 'application/json'}), 400
+    if len(criteria) == 1:
+        return jsonify({'message' : 'No articles specified', 'status' : 400, 'mimetype' : 'application/json'}), 400
+
+    # Flag all articles at once, the token identifies exactly the articles that have been changed by this request (the
+    # timestamp doesn't, other requests may change articles within the same millisecond)
+    token = uuid().hex
+    result = db.articles.update_many(criteria, {'$set' : {key : value, 'modified' : utcnow(), 'flag-token' : token}})
+
+    if result.modified_count:
+        # Aggregate the counter changes (of visible articles) per feed and tag, then apply them in one bulk write each
+        # Articles that have been flagged again in the meantime still count, i.e. the flag itself is not matched (the other
+        # criteria never change and only help to use an index)
+        match = {'$match' : dict({name : condition for name, condition in criteria.items() if name != key}, **{'flag-token' : token})}
+        visible = {'$sum' : {'$cond' : [{'$eq' : ['$show', True]}, 1, 0]}}
+        feeds = list(db.articles.aggregate([match, {'$group' : {'_id' : '$feed-id', 'n' : visible}}]))
+        operations = [UpdateOne({'_id' : feed['_id']}, {'$inc' : {counter : feed['n'] * delta(key, value)}}) for feed in feeds if feed['n']]
+        if operations:
+            db.feeds.bulk_write(operations, ordered = False)
+        tags = list(db.articles.aggregate([match, {'$unwind' : '$tags'}, {'$group' : {'_id' : '$tags', 'n' : visible}}]))
+        operations = [UpdateOne({'title' : tag['_id']}, {'$inc' : {counter : tag['n'] * delta(key, value)}}) for tag in tags if tag['n']]
+        if operations:
+            db.tags.bulk_write(operations, ordered = False)
+        # Only the lists that contain these articles have changed (not the RSS outputs), the counters are not cached (see cache.counters)
+        cache.touch(db, ['list:articles'] + ['list:feed:%s' % feed['_id'] for feed in feeds] + ['list:tag:%s' % tag['_id'] for tag in tags])
+
+    return jsonify({'message' : 'Ok', 'status' : 200, 'mimetype' : 'application/json', 'modified' : result.modified_count})
+
+@app.route('/counters')
+def unread_counters():
+
+    # The sidebars load the number of unread articles on their own, i.e. the pages stay the same while articles are read
+    return jsonify(dict(cache.counters(g.db), message = 'Ok', status = 200, mimetype = 'application/json'))
+
+def snapshot(db):
+    ''' Returns the latest statistics snapshot (see the "universs.update_statistics" task) and its age in minutes. '''
+
+    document = db.state.find_one({'_id' : 'statistics'})
+    if not document:
+        return {'statistics' : {}, 'analytics' : {}}, None
+    return document, int((utcnow() - document['created']).total_seconds() // 60)
 
-    analytics = {}
-    analytics['feeds-without-articles'] = []
-    for feed in db.feeds.find():
-        if db.articles.find({'feed-id' : feed['_id']}).count() == 0:
-            analytics['feeds-without-articles'].append(feed)
+@app.route('/analytics')
+def analytics():
 
-    return render_template('./analytics.html', analytics = analytics, feeds = g.feeds)
+    document, age = snapshot(g.db)
+
+    return render_template('./analytics.html', analytics = document['analytics'], snapshot = document, age = age, feeds = documents('feeds'))
 
 @app.route('/statistics')
 def statistics():
 
-    db = g.db
+    document, age = snapshot(g.db)
+
+    return render_template('./statistics.html', stats = document['statistics'], snapshot = document, age = age, feeds = documents('feeds'))
+
+@app.route('/statistics/refresh')
+def refresh_statistics():
+
+    from universs.tasks import update_statistics
+    # The snapshot is computed in the background, the page shows the previous one (and its age) until then
+    update_statistics.delay()
 
-    stats = {}
-    stats['number-of-feeds'] = db.feeds.count()
-    stats['number-of-inactive-feeds'] = db.feeds.find({'active' : False}).count()
-    stats['number-of-articles'] = db.articles.count()
-    stats['number-of-tags'] = db.tags.count()
-    stats['number-of-agents'] = db.agents.count()
-    stats['number-of-filters'] = db.filters.count()
-    stats['number-of-unfiltered-articles'] = db.articles.find({'show' : True}).count()
-    stats['number-of-filtered-articles'] = stats['number-of-articles'] - stats['number-of-unfiltered-articles']
-    stats['number-of-unread-articles'] = db.articles.find({'show' : True, 'read' : False}).count()
-    stats['number-of-marked-articles'] = db.articles.find({'show' : True, 'marked' : True}).count()
-    stats['number-of-starred-articles'] = db.articles.find({'show' : True, 'starred' : True}).count()
-
-    stats['database-size'] = db.command("dbstats")['dataSize'] / 1024.0**2
-    stats['last-update'] = db.feeds.find(sort = [('last-update', -1)], limit = 1)[0]['last-update']
-
-    return render_template('./statistics.html', stats = stats, feeds = g.feeds)
+    return redirect(request.referrer or url_for('statistics'))
 
 if __name__ == '__main__':
     app.run(debug = True)